@@ -0,0 +1,351 @@
+"""
+Audio Pipeline
+Microphone capture, voice activity detection and streaming speech-to-text
+for the voice assistant.
+Place this file at: audio_pipeline.py (root level)
+
+pyaudio, numpy and openai-whisper are imported on first use, so the
+assistant still runs in text mode when they are not installed.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Audio is 16 kHz mono 16-bit PCM, the format Whisper expects
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+@dataclass
+class Hypothesis:
+    text: str
+    final: bool
+    # Leading words that the last stability_count partials agreed on
+    stable: str = ""
+    audio_seconds: float = 0.0
+
+class StreamingTranscriber:
+    """Transcribes chunked audio with Whisper, emitting partial and final hypotheses.
+
+    Every step_ms of new audio the most recent window_s seconds of the
+    utterance are transcribed again. Whisper reads at most 30 seconds at a
+    time, so longer utterances keep only their end. Audio keeps being read
+    while a pass runs, and only one pass runs at a time: steps that arrive
+    during a pass are not transcribed separately, the next pass covers all
+    audio up to its start. A word prefix counts
+    as stable once stability_count consecutive partials agree on it, which
+    is the point where the dispatcher can start matching.
+    """
+
+    def __init__(self, model: str = "base", language: Optional[str] = "en", device: Optional[str] = None,
+                 step_ms: int = 500, window_s: float = 30.0, stability_count: int = 2):
+        self.model_name = model
+        self.language = language
+        self.device = device
+        self.step_ms = step_ms
+        self.window_s = window_s
+        self.stability_count = stability_count
+        self._model: Any = None
+        self._model_lock = asyncio.Lock()
+
+    async def _get_model(self) -> Any:
+        async with self._model_lock:
+            if self._model is None:
+                try:
+                    import whisper
+                except ImportError as e:
+                    raise RuntimeError("Streaming transcription needs openai-whisper (pip install openai-whisper)") from e
+                loop = asyncio.get_running_loop()
+                self._model = await loop.run_in_executor(None, lambda: whisper.load_model(self.model_name, device=self.device))
+                logger.info(f"Loaded Whisper model '{self.model_name}'")
+        return self._model
+
+    async def _transcribe_pcm(self, pcm: bytes) -> str:
+        import numpy as np
+
+        model = await self._get_model()
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        options = {
+            "language": self.language,
+            "fp16": False,
+            "temperature": 0.0,
+            # Each window is transcribed from scratch; earlier text would only bias it
+            "condition_on_previous_text": False
+        }
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(None, lambda: model.transcribe(audio, **options))
+        return result.get("text", "").strip()
+
+    def _window(self, pcm: bytearray) -> bytes:
+        window_bytes = int(self.window_s * SAMPLE_RATE) * SAMPLE_WIDTH
+        return bytes(pcm[-window_bytes:])
+
+    @staticmethod
+    def _common_prefix(hypotheses: List[List[str]]) -> List[str]:
+        prefix = []
+        for words in zip(*hypotheses):
+            # Punctuation and case flicker between partials without the words changing
+            normalized = {word.lower().strip(".,!?") for word in words}
+            if len(normalized) != 1:
+                break
+            prefix.append(words[-1])
+        return prefix
+
+    async def transcribe(self, pcm: bytes) -> str:
+        """Transcribe a complete utterance"""
+        if not pcm:
+            return ""
+        return await self._transcribe_pcm(self._window(bytearray(pcm)))
+
+    async def transcribe_stream(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[Hypothesis]:
+        """Yield partial hypotheses while chunks arrive, then one final hypothesis when they end"""
+        step_bytes = int(self.step_ms * SAMPLE_RATE / 1000) * SAMPLE_WIDTH
+        pcm = bytearray()
+        arrived = asyncio.Event()
+        ended = False
+        recent: deque = deque(maxlen=self.stability_count)
+
+        async def read():
+            nonlocal ended
+            try:
+                async for chunk in chunks:
+                    pcm.extend(chunk)
+                    arrived.set()
+            finally:
+                ended = True
+                arrived.set()
+
+        # Reading runs beside inference so a slow pass does not hold up the audio source
+        reader = asyncio.create_task(read())
+        try:
+            transcribed = 0
+            while True:
+                await arrived.wait()
+                arrived.clear()
+                if ended:
+                    break
+                if len(pcm) - transcribed < step_bytes:
+                    continue
+                transcribed = len(pcm)
+
+                text = await self._transcribe_pcm(self._window(pcm))
+                recent.append(text.split())
+                stable = self._common_prefix(list(recent)) if len(recent) == self.stability_count else []
+                yield Hypothesis(text, False, " ".join(stable), transcribed / (SAMPLE_RATE * SAMPLE_WIDTH))
+            # Surfaces errors raised by the audio source
+            await reader
+        finally:
+            reader.cancel()
+
+        text = await self.transcribe(bytes(pcm))
+        yield Hypothesis(text, True, text, len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH))
+
+class VoiceActivityDetector:
+    """Energy and zero-crossing voice activity detection over fixed-size frames.
+
+    A frame is voiced when its RMS energy clears both energy_threshold and
+    noise_ratio times the running noise floor, and its zero-crossing rate
+    stays under max_zcr (broadband hiss crosses zero far more often than
+    speech). A segment opens after start_ms of consecutive voiced frames
+    and closes after hangover_ms of unvoiced ones, which are kept so word
+    endings are not clipped. preroll_ms of audio from before the opening
+    is prepended for the same reason at the start. Segments with less than
+    min_speech_ms of voiced audio are dropped and long ones are cut at
+    max_segment_s. segment_streams() buffers at most max_queued_frames
+    frames per stream that its consumer has not read yet.
+    """
+
+    def __init__(self, frame_ms: int = 30, energy_threshold: float = 300.0, noise_ratio: float = 3.0,
+                 max_zcr: float = 0.35, start_ms: int = 90, hangover_ms: int = 400, preroll_ms: int = 300,
+                 min_speech_ms: int = 200, max_segment_s: float = 30.0, max_queued_frames: int = 200):
+        self.frame_ms = frame_ms
+        self.frame_bytes = int(SAMPLE_RATE * frame_ms / 1000) * SAMPLE_WIDTH
+        self.energy_threshold = energy_threshold
+        self.noise_ratio = noise_ratio
+        self.max_zcr = max_zcr
+        self.start_frames = max(1, start_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_segment_frames = int(max_segment_s * 1000 / frame_ms)
+        self.max_queued_frames = max_queued_frames
+        self.noise_floor = 0.0
+
+        self._preroll: deque = deque(maxlen=max(self.start_frames, preroll_ms // frame_ms + self.start_frames))
+        self._segment: List[bytes] = []
+        self._voiced_run = 0
+        self._silent_run = 0
+        self._speech_frames = 0
+
+    @property
+    def in_speech(self) -> bool:
+        return bool(self._segment)
+
+    def is_speech(self, frame: bytes) -> bool:
+        import numpy as np
+
+        samples = np.frombuffer(frame, dtype=np.int16).astype(np.float32)
+        if samples.size < 2:
+            return False
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        signs = np.signbit(samples)
+        zcr = np.count_nonzero(signs[1:] != signs[:-1]) / (samples.size - 1)
+        voiced = rms > max(self.energy_threshold, self.noise_floor * self.noise_ratio) and zcr < self.max_zcr
+        if not voiced and not self.in_speech:
+            # Track background noise so a noisy room raises the bar
+            self.noise_floor = rms if self.noise_floor == 0.0 else 0.95 * self.noise_floor + 0.05 * rms
+        return voiced
+
+    def push(self, frame: bytes) -> Optional[bytes]:
+        """Feed one frame, returning a finished voiced segment when one closes"""
+        voiced = self.is_speech(frame)
+
+        if not self.in_speech:
+            self._preroll.append(frame)
+            self._voiced_run = self._voiced_run + 1 if voiced else 0
+            if self._voiced_run >= self.start_frames:
+                self._segment = list(self._preroll)
+                self._preroll.clear()
+                self._speech_frames = self._voiced_run
+                self._silent_run = 0
+            return None
+
+        self._segment.append(frame)
+        if voiced:
+            self._speech_frames += 1
+            self._silent_run = 0
+        else:
+            self._silent_run += 1
+        if self._silent_run >= self.hangover_frames or len(self._segment) >= self.max_segment_frames:
+            return self._close()
+        return None
+
+    def flush(self) -> Optional[bytes]:
+        """Close any open segment, e.g. when the audio stream ends"""
+        return self._close() if self.in_speech else None
+
+    def _close(self) -> Optional[bytes]:
+        segment, speech_frames = self._segment, self._speech_frames
+        self._segment = []
+        self._voiced_run = self._silent_run = self._speech_frames = 0
+        if speech_frames < self.min_speech_frames:
+            return None
+        return b"".join(segment)
+
+    async def _frames(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        pending = bytearray()
+        async for chunk in chunks:
+            pending.extend(chunk)
+            while len(pending) >= self.frame_bytes:
+                frame = bytes(pending[:self.frame_bytes])
+                del pending[:self.frame_bytes]
+                yield frame
+
+    async def segments(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+        """Yield the voiced segments of an audio stream, dropping everything else"""
+        async for frame in self._frames(chunks):
+            segment = self.push(frame)
+            if segment is not None:
+                yield segment
+        segment = self.flush()
+        if segment is not None:
+            yield segment
+
+    async def segment_streams(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[AsyncIterator[bytes]]:
+        """Yield each voiced segment as a stream of its frames while it is still being spoken.
+
+        A stream opens once its segment has min_speech_ms of voiced audio,
+        so it is never one that segments() would drop, and starts with the
+        frames buffered up to then. It ends when the segment closes. Streams
+        have to be consumed concurrently, since this generator only reads on
+        while it is iterated. When a stream's consumer falls max_queued_frames
+        behind, reading waits for it, which leaves the audio source to drop
+        or buffer frames (MicrophoneStream drops the oldest).
+        """
+        queue: Optional[asyncio.Queue] = None
+        async for frame in self._frames(chunks):
+            segment = self.push(frame)
+            if queue is not None:
+                await queue.put(frame)
+                if not self.in_speech:
+                    await queue.put(None)
+                    queue = None
+            elif segment is not None:
+                # Confirmed by the same frame that closed it
+                yield self._drain(self._queue_of([segment, None]))
+            elif self.in_speech and self._speech_frames >= self.min_speech_frames:
+                queue = self._queue_of(self._segment)
+                yield self._drain(queue)
+        self.flush()
+        if queue is not None:
+            await queue.put(None)
+
+    def _queue_of(self, frames: List[Optional[bytes]]) -> asyncio.Queue:
+        # Room for the frames buffered before the stream opened, however many there are
+        queue: asyncio.Queue = asyncio.Queue(maxsize=max(self.max_queued_frames, len(frames)))
+        for frame in frames:
+            queue.put_nowait(frame)
+        return queue
+
+    @staticmethod
+    async def _drain(queue: asyncio.Queue) -> AsyncIterator[bytes]:
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                # The segment closed
+                return
+            yield frame
+
+class MicrophoneStream:
+    """Microphone capture through pyaudio, delivered as an async stream of PCM frames.
+
+    pyaudio's callback thread hands frames to the event loop through a
+    bounded queue; if the consumer falls behind, the oldest frames are
+    dropped rather than letting capture latency grow.
+    """
+
+    def __init__(self, frame_ms: int = 30, device_index: Optional[int] = None, max_queued_frames: int = 200):
+        self.frames_per_buffer = int(SAMPLE_RATE * frame_ms / 1000)
+        self.device_index = device_index
+        self.max_queued_frames = max_queued_frames
+        self.dropped_frames = 0
+
+    async def frames(self) -> AsyncIterator[bytes]:
+        try:
+            import pyaudio
+        except ImportError as e:
+            raise RuntimeError("Microphone capture needs pyaudio (pip install pyaudio)") from e
+
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_queued_frames)
+
+        def enqueue(frame: bytes):
+            if queue.full():
+                queue.get_nowait()
+                self.dropped_frames += 1
+            queue.put_nowait(frame)
+
+        def callback(in_data, frame_count, time_info, status):
+            loop.call_soon_threadsafe(enqueue, in_data)
+            return None, pyaudio.paContinue
+
+        audio = pyaudio.PyAudio()
+        stream = audio.open(format=pyaudio.paInt16, channels=1, rate=SAMPLE_RATE, input=True,
+                            input_device_index=self.device_index, frames_per_buffer=self.frames_per_buffer,
+                            stream_callback=callback)
+        try:
+            stream.start_stream()
+            while True:
+                yield await queue.get()
+        finally:
+            stream.stop_stream()
+            stream.close()
+            audio.terminate()
+
+def missing_voice_dependencies() -> List[str]:
+    """Modules that voice input needs but are not installed"""
+    import importlib.util
+    return [name for name in ("pyaudio", "numpy", "whisper") if importlib.util.find_spec(name) is None]
@@ -1,12 +1,26 @@
 import json
 import os
-import subprocess
+import re
 import importlib.util
+import functools
 import logging
 import asyncio
-from datetime import datetime
-from typing import Dict, Any, Optional, List, Tuple
-from dataclasses import dataclass, asdict
+import atexit
+import base64
+import copy
+import bisect
+import codecs
+import hashlib
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional, List, Tuple, Iterable, Set, Union, Callable, Awaitable
+from dataclasses import dataclass, asdict, replace
 from enum import Enum
 import yaml
 
@@ -14,6 +28,9 @@ import yaml
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Number of recent commands kept in memory for get_command_history
+HISTORY_LIMIT = 50
+
 class ExecutionEnvironment(Enum):
     PYTHON = "python"
     AUTOHOTKEY = "ahk"
@@ -27,6 +44,11 @@ class AssistantMode(Enum):
     STUDY = "study"
     STREAMING = "streaming"
 
+class CommandPriority(Enum):
+    HIGH = "high"
+    NORMAL = "normal"
+    LOW = "low"
+
 class CommandCategory(Enum):
     UTILITY = "utility"
     AUDIO = "audio"
@@ -43,6 +65,11 @@ class CommandResult:
     execution_time: float = 0.0
     metadata: Dict[str, Any] = None
 
+@dataclass
+class OutputChunk:
+    stream: str  # "stdout" or "stderr"
+    text: str
+
 @dataclass
 class Command:
     key: str
@@ -56,62 +83,627 @@ class Command:
     modes: List[AssistantMode] = None
     requires_confirmation: bool = False
     ai_parsing: bool = False
+    in_process: bool = False
+    max_concurrency: Optional[int] = None
+    priority: CommandPriority = CommandPriority.NORMAL
+    timeout_ms: Optional[int] = None
+    streaming: bool = False
+    cacheable: Optional[Dict[str, Any]] = None  # {ttl_ms, key: [parsed arg names]}; true uses the defaults
+    patterns: Optional[List[str]] = None  # Templates for RuleParser, tried before AI parsing
     metadata: Dict[str, Any] = None
 
+class KeywordAutomaton:
+    """Aho-Corasick automaton that finds every keyword occurrence in a single pass"""
+    
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = []
+        self._ids: Dict[str, int] = {}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        
+        for keyword in keywords:
+            if keyword and keyword not in self._ids:
+                self._add(keyword)
+        self._link()
+    
+    def _add(self, keyword: str):
+        self._ids[keyword] = len(self.keywords)
+        self.keywords.append(keyword)
+        
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+                self._goto[state][char] = next_state
+            state = next_state
+        self._output[state].append(self._ids[keyword])
+    
+    def _link(self):
+        # Breadth-first so every failure target is linked before its children
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                self._output[next_state] = self._output[next_state] + self._output[self._fail[next_state]]
+    
+    def keyword_id(self, keyword: str) -> Optional[int]:
+        return self._ids.get(keyword)
+    
+    def find_all(self, text: str) -> List[Tuple[int, int, int]]:
+        """Return (keyword_id, start, end) for every keyword occurrence in text"""
+        hits = []
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for keyword_id in self._output[state]:
+                hits.append((keyword_id, index + 1 - len(self.keywords[keyword_id]), index + 1))
+        return hits
+
+class ModeMatcher:
+    """Precompiled keyword matcher for the commands available in one mode"""
+    
+    def __init__(self, mode: AssistantMode, commands: Iterable[Command]):
+        self.mode = mode
+        # Commands without modes are available everywhere
+        self.commands = [cmd for cmd in commands if not cmd.modes or mode in cmd.modes]
+        self._automaton = KeywordAutomaton(keyword.lower() for cmd in self.commands for keyword in cmd.keywords)
+        self._postings: Dict[int, List[Tuple[int, int, Command]]] = {}
+        self._blank: List[Tuple[int, int, Command]] = []
+        
+        for order, cmd in enumerate(self.commands):
+            for position, keyword in enumerate(cmd.keywords):
+                keyword_id = self._automaton.keyword_id(keyword.lower())
+                entry = (order, position, cmd)
+                if keyword_id is None:
+                    # Blank keywords match every input, keep that behaviour
+                    self._blank.append(entry)
+                else:
+                    self._postings.setdefault(keyword_id, []).append(entry)
+    
+    @staticmethod
+    def _score_hit(start: int, end: int, input_length: int) -> float:
+        # Higher score for exact matches, partial score for partial matches
+        if start == 0 and end == input_length:
+            return 1.0
+        elif start == 0:
+            return 0.8
+        return 0.5
+    
+    def match(self, user_input: str) -> List[Tuple[Command, float]]:
+        """Find matching commands with confidence scores"""
+        user_input_lower = user_input.lower()
+        input_length = len(user_input_lower)
+        
+        # Best score per keyword across all of its occurrences in the input
+        keyword_scores: Dict[int, float] = {}
+        for keyword_id, start, end in self._automaton.find_all(user_input_lower):
+            score = self._score_hit(start, end, input_length)
+            if score > keyword_scores.get(keyword_id, 0.0):
+                keyword_scores[keyword_id] = score
+        
+        candidates: Dict[Tuple[int, int], Tuple[Command, float]] = {}
+        for order, position, cmd in self._blank:
+            candidates[(order, position)] = (cmd, self._score_hit(0, 0, input_length))
+        for keyword_id, score in keyword_scores.items():
+            for order, position, cmd in self._postings[keyword_id]:
+                candidates[(order, position)] = (cmd, score)
+        
+        # Sum in registry and keyword order so results match a full scan
+        scores: Dict[int, Tuple[Command, float]] = {}
+        for order, position in sorted(candidates):
+            cmd, score = candidates[(order, position)]
+            previous = scores[order][1] if order in scores else 0.0
+            scores[order] = (cmd, previous + score)
+        
+        matches = [scores[order] for order in sorted(scores)]
+        
+        # Sort by score descending
+        matches.sort(key=lambda x: x[1], reverse=True)
+        return matches
+
+class StateBackend:
+    """Storage interface used by StateManager"""
+    
+    # Whether query_history can search beyond the in-memory window
+    indexed_history = False
+    
+    # Whether single keys can be stored without rewriting the whole state,
+    # so lazily updated keys can ride along with every flush
+    incremental_keys = False
+    
+    def load(self) -> Dict[str, Any]:
+        """Return the stored state, with last_commands holding the most recent history"""
+        raise NotImplementedError
+    
+    def persist(self, state: Dict[str, Any], changed_keys: Set[str], entries: List[Dict[str, Any]]):
+        """Store the changed state keys and append new history entries"""
+        raise NotImplementedError
+    
+    def query_history(self, limit: int, command: Optional[str] = None, success: Optional[bool] = None,
+                      since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return the most recent matching stored entries, oldest first"""
+        raise NotImplementedError
+    
+    def journal_tail(self) -> List[Dict[str, Any]]:
+        """History entries load() found that were recorded after the state keys were last stored"""
+        return []
+    
+    def close(self):
+        pass
+
+class JsonStateBackend(StateBackend):
+    """JSON snapshot plus an append-only JSONL history journal.
+
+    Recording a command appends one sequence-numbered line to the journal.
+    The journal is folded back into the snapshot every compact_every entries
+    and whenever the snapshot is rewritten anyway.
+    """
+    
+    def __init__(self, state_file: str, compact_every: int = 200):
+        self.state_file = state_file
+        self.journal_file = f"{os.path.splitext(state_file)[0]}_history.jsonl"
+        self.compact_every = compact_every
+        self._seq = 0
+        self._journal_entries = 0
+        self._journal = None
+        self._tail: List[Dict[str, Any]] = []
+    
+    def load(self) -> Dict[str, Any]:
+        os.makedirs(os.path.dirname(self.state_file) or ".", exist_ok=True)
+        try:
+            with open(self.state_file, 'r') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        self._seq = state.get("history_seq", 0)
+        self._replay_journal(state)
+        self._journal = open(self.journal_file, 'a')
+        return state
+    
+    def _replay_journal(self, state: Dict[str, Any]):
+        """Apply journal entries newer than the snapshot to the loaded state"""
+        history = state.setdefault("last_commands", [])
+        try:
+            with open(self.journal_file, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-append
+                        logger.warning(f"Skipping unreadable entry in {self.journal_file}")
+                        continue
+                    self._journal_entries += 1
+                    seq = entry.pop("seq", 0)
+                    if seq <= self._seq:
+                        continue
+                    history.append(entry)
+                    self._tail.append(entry)
+                    self._seq = seq
+        except FileNotFoundError:
+            pass
+        state["history_seq"] = self._seq
+        del history[:-HISTORY_LIMIT]
+    
+    def journal_tail(self) -> List[Dict[str, Any]]:
+        return self._tail
+    
+    def persist(self, state: Dict[str, Any], changed_keys: Set[str], entries: List[Dict[str, Any]]):
+        if changed_keys or self._journal_entries + len(entries) >= self.compact_every:
+            self._write_snapshot(state, len(entries))
+        elif entries:
+            lines = []
+            for entry in entries:
+                self._seq += 1
+                lines.append(json.dumps({"seq": self._seq, **entry}) + "\n")
+            self._journal.write("".join(lines))
+            self._journal.flush()
+            self._journal_entries += len(entries)
+    
+    def _write_snapshot(self, state: Dict[str, Any], new_entries: int):
+        # The pending entries are already in last_commands, so the snapshot covers them
+        self._seq += new_entries
+        state["history_seq"] = self._seq
+        data = json.dumps(state, indent=2)
+        # Write to a temp file and swap it in so a crash never leaves a torn file
+        tmp_file = f"{self.state_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(data)
+        os.replace(tmp_file, self.state_file)
+        # Every journal entry is now covered by the snapshot's history_seq
+        self._journal.close()
+        self._journal = open(self.journal_file, 'w')
+        self._journal_entries = 0
+        self._tail = []
+    
+    def close(self):
+        if self._journal is not None:
+            self._journal.close()
+
+class SqliteStateBackend(StateBackend):
+    """SQLite database in WAL mode with indexed, long-term command history"""
+    
+    indexed_history = True
+    incremental_keys = True
+    
+    # Keys derived from the history table rather than stored in the state table
+    DERIVED_KEYS = {"last_commands", "history_seq"}
+    
+    def __init__(self, database_file: str, history_retention_days: Optional[int] = None):
+        self.database_file = database_file
+        self.history_retention_days = history_retention_days
+        self._conn: Optional[sqlite3.Connection] = None
+    
+    def load(self) -> Dict[str, Any]:
+        os.makedirs(os.path.dirname(self.database_file) or ".", exist_ok=True)
+        # StateManager serializes access, the flush timer runs on another thread
+        self._conn = sqlite3.connect(self.database_file, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            self._conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT NOT NULL, command TEXT NOT NULL, "
+                "input TEXT, success INTEGER NOT NULL, output TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history (timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_command ON history (command, timestamp)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_history_success ON history (success, timestamp)")
+            if self.history_retention_days:
+                cutoff = (datetime.now() - timedelta(days=self.history_retention_days)).isoformat()
+                self._conn.execute("DELETE FROM history WHERE timestamp < ?", (cutoff,))
+        
+        state = {row["key"]: json.loads(row["value"]) for row in self._conn.execute("SELECT key, value FROM state")}
+        state["last_commands"] = self.query_history(HISTORY_LIMIT)
+        return state
+    
+    def persist(self, state: Dict[str, Any], changed_keys: Set[str], entries: List[Dict[str, Any]]):
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                [(key, json.dumps(state[key])) for key in changed_keys
+                 if key in state and key not in self.DERIVED_KEYS]
+            )
+            self._conn.executemany(
+                "INSERT INTO history (timestamp, command, input, success, output) VALUES (?, ?, ?, ?, ?)",
+                [(e["timestamp"], e["command"], e["input"], int(e["success"]), e["output"]) for e in entries]
+            )
+    
+    def query_history(self, limit: int, command: Optional[str] = None, success: Optional[bool] = None,
+                      since: Optional[str] = None) -> List[Dict[str, Any]]:
+        clauses, params = [], []
+        if command is not None:
+            clauses.append("command = ?")
+            params.append(command)
+        if success is not None:
+            clauses.append("success = ?")
+            params.append(int(success))
+        if since is not None:
+            clauses.append("timestamp >= ?")
+            params.append(since)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._conn.execute(
+            f"SELECT timestamp, command, input, success, output FROM history{where} ORDER BY id DESC LIMIT ?",
+            (*params, limit)
+        ).fetchall()
+        return [{**dict(row), "success": bool(row["success"])} for row in reversed(rows)]
+    
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
 class StateManager:
-    def __init__(self, state_file: str = "state/assistant_state.json"):
+    """Persistent assistant state on a pluggable StateBackend.
+
+    backend is "json" (snapshot plus history journal), "sqlite" (indexed
+    long-term history) or a StateBackend instance.
+
+    By default every change is written straight to disk. With write_behind
+    enabled, changes are merged in memory and flushed from a background
+    timer instead: at most durability_ms after the first unflushed change,
+    as soon as max_dirty changes are pending, or on close(). A crash can
+    therefore lose at most durability_ms worth of changes.
+
+    Keys registered with track() (running counters) are derived from the
+    history: each new entry is folded into them in place, and they do not
+    trigger a write of their own. Backends that store keys incrementally
+    write them with the next flush; the JSON backend writes them with its
+    next full snapshot and, on load, folds in the journal entries recorded
+    since, so they always agree with the history. The state is only
+    changed under the lock, and get() and set() copy values, so the flush
+    thread never serializes a dict that callers are modifying.
+    """
+    
+    def __init__(self, state_file: str = "state/assistant_state.json", backend: Union[str, StateBackend] = "json",
+                 write_behind: bool = False, durability_ms: int = 1000, max_dirty: int = 20,
+                 compact_every: int = 200, database_file: Optional[str] = None,
+                 history_retention_days: Optional[int] = None):
         self.state_file = state_file
+        if isinstance(backend, StateBackend):
+            self.backend = backend
+        elif backend == "json":
+            self.backend = JsonStateBackend(state_file, compact_every)
+        elif backend == "sqlite":
+            database_file = database_file or f"{os.path.splitext(state_file)[0]}.db"
+            self.backend = SqliteStateBackend(database_file, history_retention_days)
+        else:
+            raise ValueError(f"Unknown state backend: {backend}")
+        self.write_behind = write_behind
+        self.durability_ms = durability_ms
+        self.max_dirty = max_dirty
+        self._lock = threading.RLock()
+        self._dirty = 0
+        self._changed_keys: Set[str] = set()
+        # Derived keys written along with other changes rather than on their own
+        self._lazy_keys: Set[str] = set()
+        self._trackers: Dict[str, Callable[[Any, Dict[str, Any]], None]] = {}
+        self._pending_entries: List[Dict[str, Any]] = []
+        self._flush_timer: Optional[threading.Timer] = None
         self.state = self._load_state()
+        if self.write_behind:
+            atexit.register(self.close)
         
     def _load_state(self) -> Dict[str, Any]:
-        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
-        try:
-            with open(self.state_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return {
-                "current_mode": AssistantMode.GENERAL.value,
-                "last_commands": [],
-                "user_preferences": {},
-                "aliases": {},
-                "session_start": datetime.now().isoformat()
-            }
+        state = {
+            "current_mode": AssistantMode.GENERAL.value,
+            "last_commands": [],
+            "user_preferences": {},
+            "aliases": {},
+            "session_start": datetime.now().isoformat()
+        }
+        stored = self.backend.load()
+        # Defaults the backend has never seen are persisted with the next flush
+        self._changed_keys.update(state.keys() - stored.keys())
+        state.update(stored)
+        return state
     
     def save_state(self):
-        with open(self.state_file, 'w') as f:
-            json.dump(self.state, f, indent=2)
+        """Write every state key to the backend"""
+        with self._lock:
+            self._changed_keys.update(self.state)
+            self._lazy_keys = set()
+            self.flush()
+    
+    def _mark_dirty(self):
+        """Record a change and persist it according to the write mode"""
+        if not self.write_behind:
+            self.flush()
+            return
+        
+        with self._lock:
+            self._dirty += 1
+            if self._dirty >= self.max_dirty:
+                self._schedule_flush(0)
+            elif self._flush_timer is None:
+                self._schedule_flush(self.durability_ms / 1000)
+    
+    def _schedule_flush(self, delay: float):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+        self._flush_timer = threading.Timer(delay, self.flush)
+        self._flush_timer.daemon = True
+        self._flush_timer.start()
+    
+    def flush(self):
+        """Write pending changes to the backend, if there are any"""
+        with self._lock:
+            if self._flush_timer is not None:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if self._changed_keys or self._pending_entries:
+                changed_keys = self._changed_keys
+                if self.backend.incremental_keys:
+                    changed_keys = changed_keys | self._lazy_keys
+                    self._lazy_keys = set()
+                self.backend.persist(self.state, changed_keys, self._pending_entries)
+            self._changed_keys = set()
+            self._pending_entries = []
+            self._dirty = 0
+    
+    def close(self):
+        """Flush pending changes and release the backend"""
+        with self._lock:
+            self._changed_keys.update(self._lazy_keys)
+            self._lazy_keys = set()
+            if self._changed_keys or self._pending_entries:
+                self.flush()
+            self.backend.close()
     
     def get(self, key: str, default=None):
-        return self.state.get(key, default)
+        # A copy, so callers cannot change the state while a flush thread serializes it
+        with self._lock:
+            return copy.deepcopy(self.state.get(key, default))
     
     def set(self, key: str, value: Any):
-        self.state[key] = value
-        self.save_state()
+        with self._lock:
+            self.state[key] = copy.deepcopy(value)
+            self._lazy_keys.discard(key)
+            self._changed_keys.add(key)
+        self._mark_dirty()
+    
+    def track(self, key: str, apply: Callable[[Any, Dict[str, Any]], None],
+              seed: Callable[[List[Dict[str, Any]]], Any]):
+        """Keep a key derived from the command history, such as usage counters, up to date.
+
+        apply(value, entry) folds one history entry into the value in place.
+        A stored value is first caught up with the backend's journal tail;
+        without one, seed(history) builds it from the in-memory history.
+        """
+        with self._lock:
+            if key in self.state:
+                for entry in self.backend.journal_tail():
+                    apply(self.state[key], entry)
+            else:
+                self.state[key] = seed(list(self.state.get("last_commands", [])))
+            self._trackers[key] = apply
+            if key not in self._changed_keys:
+                self._lazy_keys.add(key)
     
     def add_to_history(self, command_key: str, input_text: str, result: CommandResult):
-        history = self.state.get("last_commands", [])
-        history.append({
-            "timestamp": datetime.now().isoformat(),
-            "command": command_key,
-            "input": input_text,
-            "success": result.success,
-            "output": result.output[:200] if result.output else None  # Truncate for storage
-        })
-        # Keep only last 50 commands
-        self.state["last_commands"] = history[-50:]
-        self.save_state()
+        with self._lock:
+            entry = {
+                "timestamp": datetime.now().isoformat(),
+                "command": command_key,
+                "input": input_text,
+                "success": result.success,
+                "output": result.output[:200] if result.output else None,  # Truncate for storage
+                "execution_time": result.execution_time
+            }
+            history = self.state.setdefault("last_commands", [])
+            history.append(entry)
+            # Keep only the most recent commands in memory
+            if len(history) > HISTORY_LIMIT:
+                del history[0]
+            # Derived keys change together with the history, so a snapshot never sees one without the other
+            for key, apply in self._trackers.items():
+                apply(self.state[key], entry)
+                if key not in self._changed_keys:
+                    self._lazy_keys.add(key)
+            self._pending_entries.append(entry)
+        self._mark_dirty()
+    
+    def query_history(self, limit: int = 10, command: Optional[str] = None, success: Optional[bool] = None,
+                      since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Return the most recent matching history entries, oldest first"""
+        with self._lock:
+            if self.backend.indexed_history:
+                if self._pending_entries:
+                    self.flush()
+                return self.backend.query_history(limit, command, success, since)
+            # Other backends only know the in-memory window
+            results = [entry for entry in self.state.get("last_commands", [])
+                       if (command is None or entry.get("command") == command)
+                       and (success is None or entry.get("success") == success)
+                       and (since is None or entry.get("timestamp", "") >= since)]
+            return results[-limit:]
+
+class RuleParser:
+    """Deterministic slot filling from per-command pattern templates.
+
+    A template is a phrase with {name:type} slots, e.g.
+    "patch strip {strip:int} to {bus:word}". Types are int, float, word
+    (the default), text (any run of words) or a list of choices such as
+    {action:mute|unmute}. Templates are compiled to anchored regexes once
+    per registry load; parse() returns None when no template matches so
+    the caller can fall back to the AI parser.
+    """
+    
+    SLOT = re.compile(r"\{(\w+)(?::([^}]+))?\}")
+    SLOT_TYPES = {
+        "int": (r"[-+]?\d+", int),
+        "float": (r"[-+]?\d+(?:\.\d+)?", float),
+        "word": (r"\S+", str),
+        "text": (r".+?", str),
+    }
+    
+    def __init__(self, commands: Iterable[Command]):
+        # command key -> [(template, regex, slot converters)]
+        self.patterns: Dict[str, List[Tuple[str, "re.Pattern", Dict[str, Callable[[str], Any]]]]] = {}
+        for cmd in commands:
+            for template in cmd.patterns or []:
+                try:
+                    regex, converters = self.compile(template)
+                except ValueError as e:
+                    logger.error(f"Skipping pattern '{template}' of command {cmd.key}: {e}")
+                    continue
+                self.patterns.setdefault(cmd.key, []).append((template, regex, converters))
+    
+    @staticmethod
+    def _choice(value: str) -> str:
+        # Choices match case-insensitively across any whitespace; return them in one canonical form
+        return " ".join(value.lower().split())
+    
+    @classmethod
+    def _literal(cls, text: str) -> str:
+        return r"\s+".join(re.escape(word) for word in text.split(" "))
+    
+    @classmethod
+    def compile(cls, template: str) -> Tuple["re.Pattern", Dict[str, Callable[[str], Any]]]:
+        parts = []
+        converters: Dict[str, Callable[[str], Any]] = {}
+        position = 0
+        for slot in cls.SLOT.finditer(template):
+            parts.append(cls._literal(template[position:slot.start()]))
+            name, slot_type = slot.group(1), (slot.group(2) or "word").strip()
+            if name in converters:
+                raise ValueError(f"duplicate slot {name}")
+            if slot_type in cls.SLOT_TYPES:
+                expression, converters[name] = cls.SLOT_TYPES[slot_type]
+            elif re.fullmatch(r"[\w ]+(\|[\w ]+)*", slot_type):
+                choices = [choice.strip() for choice in slot_type.split("|")]
+                expression = "|".join(cls._literal(choice) for choice in choices)
+                converters[name] = cls._choice
+            else:
+                raise ValueError(f"unknown slot type {slot_type}")
+            parts.append(f"(?P<{name}>{expression})")
+            position = slot.end()
+        parts.append(cls._literal(template[position:]))
+        # Transcripts often end with punctuation
+        regex = re.compile(r"\s*" + "".join(parts) + r"\s*[.!?]*\s*", re.IGNORECASE)
+        return regex, converters
+    
+    def parse(self, user_input: str, command: Command) -> Optional[Dict[str, Any]]:
+        for template, regex, converters in self.patterns.get(command.key, []):
+            match = regex.fullmatch(user_input)
+            if match is None:
+                continue
+            parsed = {"raw_input": user_input, "command_key": command.key}
+            for name, convert in converters.items():
+                parsed[name] = convert(match.group(name))
+            logger.debug(f"Parsed '{user_input}' with pattern '{template}'")
+            return parsed
+        return None
 
 class CommandRegistry:
     def __init__(self, registry_file: str = "config/commands.yaml"):
         self.registry_file = registry_file
         self.commands: Dict[str, Command] = {}
-        self._load_commands()
+        self.matchers: Dict[AssistantMode, ModeMatcher] = {}
+        self.rule_parser = RuleParser([])
+        # Bumped on every reload so caches keyed on it drop stale commands
+        self.version = 0
+        self._install(self._load_commands())
+    
+    def reload(self):
+        """Reload the registry file and rebuild the per-mode matchers.
+
+        Everything is built before anything is swapped in, so a registry
+        file that fails to load raises and leaves the current commands and
+        matchers in use.
+        """
+        self._install(self._load_commands())
+        self.version += 1
+    
+    def _install(self, commands: Dict[str, Command]):
+        matchers, rule_parser = self._build_matchers(commands)
+        self.commands, self.matchers, self.rule_parser = commands, matchers, rule_parser
     
-    def _load_commands(self):
+    def _load_commands(self) -> Dict[str, Command]:
+        commands: Dict[str, Command] = {}
         try:
             with open(self.registry_file, 'r') as f:
                 data = yaml.safe_load(f)
                 for cmd_data in data.get('commands', []):
+                    cacheable = cmd_data.get('cacheable')
+                    if cacheable is True:
+                        # Shorthand for caching with the default TTL, keyed on every parsed arg
+                        cacheable = {}
+                    elif not cacheable:
+                        cacheable = None
                     cmd = Command(
                         key=cmd_data['key'],
                         name=cmd_data['name'],
@@ -124,14 +716,22 @@ class CommandRegistry:
                         modes=[AssistantMode(m) for m in cmd_data.get('modes', [])],
                         requires_confirmation=cmd_data.get('requires_confirmation', False),
                         ai_parsing=cmd_data.get('ai_parsing', False),
+                        in_process=cmd_data.get('in_process', False),
+                        max_concurrency=cmd_data.get('max_concurrency'),
+                        priority=CommandPriority(cmd_data.get('priority', 'normal')),
+                        timeout_ms=cmd_data.get('timeout_ms'),
+                        streaming=cmd_data.get('streaming', False),
+                        cacheable=cacheable,
+                        patterns=cmd_data.get('patterns'),
                         metadata=cmd_data.get('metadata', {})
                     )
-                    self.commands[cmd.key] = cmd
+                    commands[cmd.key] = cmd
         except FileNotFoundError:
             logger.warning(f"Command registry file {self.registry_file} not found. Creating default.")
-            self._create_default_registry()
+            return self._create_default_registry()
+        return commands
     
-    def _create_default_registry(self):
+    def _create_default_registry(self) -> Dict[str, Command]:
         # Create a basic registry structure
         default_commands = {
             'commands': [
@@ -161,235 +761,1539 @@ class CommandRegistry:
         os.makedirs(os.path.dirname(self.registry_file), exist_ok=True)
         with open(self.registry_file, 'w') as f:
             yaml.dump(default_commands, f, default_flow_style=False)
-        self._load_commands()
+        return self._load_commands()
+    
+    @staticmethod
+    def _build_matchers(commands: Dict[str, Command]) -> Tuple[Dict[AssistantMode, ModeMatcher], RuleParser]:
+        """Precompile one ModeMatcher per AssistantMode, plus the RuleParser.
+
+        The mode filtering happens here, once per load, so matching an
+        utterance never has to check which modes a command supports.
+        """
+        matchers = {mode: ModeMatcher(mode, commands.values()) for mode in AssistantMode}
+        return matchers, RuleParser(commands.values())
     
     def find_matches(self, user_input: str, current_mode: AssistantMode) -> List[Tuple[Command, float]]:
         """Find matching commands with confidence scores"""
-        user_input_lower = user_input.lower()
-        matches = []
-        
-        for cmd in self.commands.values():
-            # Skip if command doesn't support current mode
-            if cmd.modes and current_mode not in cmd.modes:
-                continue
-                
-            score = 0.0
-            for keyword in cmd.keywords:
-                if keyword.lower() in user_input_lower:
-                    # Higher score for exact matches, partial score for partial matches
-                    if keyword.lower() == user_input_lower:
-                        score += 1.0
-                    elif user_input_lower.startswith(keyword.lower()):
-                        score += 0.8
-                    else:
-                        score += 0.5
-            
-            if score > 0:
-                matches.append((cmd, score))
-        
-        # Sort by score descending
-        matches.sort(key=lambda x: x[1], reverse=True)
-        return matches
+        return self.matchers[current_mode].match(user_input)
 
-class ExecutionEngine:
-    def __init__(self):
-        self.python_path = self._find_python_executable()
-        self.ahk_path = self._find_ahk_executable()
-        self.java_path = self._find_java_executable()
-        self.node_path = self._find_node_executable()
-    
-    def _find_python_executable(self) -> str:
-        # Try to find Python executable
-        for path in ["python", "python3", "py"]:
+# Helper processes shipped alongside the dispatcher
+WORKERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "workers")
+
+class PythonWorker:
+    """One long-lived interpreter running workers/python_worker.py"""
+    
+    def __init__(self, python_path: str):
+        self.python_path = python_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self._next_id = 0
+    
+    async def start(self):
+        self.process = await asyncio.create_subprocess_exec(
+            self.python_path, "-u", os.path.join(WORKERS_DIR, "python_worker.py"),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            limit=16 * 1024 * 1024  # Responses carry the full script output on one line
+        )
+    
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+    
+    async def request(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        self._next_id += 1
+        payload = {"id": self._next_id, **payload}
+        self.process.stdin.write((json.dumps(payload) + "\n").encode())
+        await self.process.stdin.drain()
+        line = await self.process.stdout.readline()
+        if not line:
+            raise ConnectionError(f"Python worker exited with code {await self.process.wait()}")
+        response = json.loads(line)
+        if response.get("id") != self._next_id:
+            raise ConnectionError("Python worker answered out of order")
+        return response
+    
+    def kill(self):
+        if self.alive:
+            self.process.kill()
+    
+    async def stop(self):
+        if self.alive:
+            # The worker exits once its stdin is closed
+            self.process.stdin.close()
             try:
-                subprocess.run([path, "--version"], capture_output=True, check=True)
-                return path
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                continue
-        return "python"  # Fallback
-    
-    def _find_ahk_executable(self) -> str:
-        # Common AutoHotkey paths
-        common_paths = [
-            r"C:\Program Files\AutoHotkey\AutoHotkey.exe",
-            r"C:\Program Files (x86)\AutoHotkey\AutoHotkey.exe",
-            "autohotkey.exe",
-            "ahk.exe"
-        ]
-        for path in common_paths:
-            if os.path.exists(path) or self._command_exists(path):
-                return path
-        return "autohotkey.exe"  # Fallback
-    
-    def _find_java_executable(self) -> str:
-        return "java"  # Assume java is in PATH
-    
-    def _find_node_executable(self) -> str:
-        return "node"  # Assume node is in PATH
-    
-    def _command_exists(self, command: str) -> bool:
+                await asyncio.wait_for(self.process.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                self.process.kill()
+
+class PythonWorkerPool:
+    """Pool of warm Python workers that cache command scripts by script_path.
+
+    Scripts run with an empty stdin. Modules they import stay loaded in the
+    worker between runs, so scripts should not keep state in them; see
+    workers/python_worker.py.
+    Workers are health checked every health_check_interval_ms and replaced
+    whenever they crash, stop answering or are interrupted mid-request. A
+    replacement that fails to start leaves a dead worker in its slot, which
+    is tried again on the next health check or request.
+    """
+    
+    def __init__(self, python_path: str, size: int = 2, health_check_interval_ms: int = 30000):
+        self.python_path = python_path
+        self.size = size
+        self.health_check_interval_ms = health_check_interval_ms
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._workers: List[PythonWorker] = []
+        self._tasks: Set[asyncio.Task] = set()
+        self._health_task: Optional[asyncio.Task] = None
+    
+    async def start(self):
+        for worker in await asyncio.gather(*(self._start_worker() for _ in range(self.size))):
+            self._idle.put_nowait(worker)
+        self._health_task = asyncio.create_task(self._health_loop())
+        logger.info(f"Started {self.size} Python workers")
+    
+    async def _start_worker(self) -> PythonWorker:
+        worker = PythonWorker(self.python_path)
+        await worker.start()
+        self._workers.append(worker)
+        return worker
+    
+    async def _replace(self, worker: PythonWorker) -> PythonWorker:
+        """Start a worker in place of this one, or return an unstarted placeholder if that fails"""
+        worker.kill()
+        if worker in self._workers:
+            self._workers.remove(worker)
+        try:
+            return await self._start_worker()
+        except OSError as e:
+            # Keep the slot so the pool never shrinks; a dead worker is restarted on its next use
+            logger.error(f"Could not start Python worker: {e}")
+            return PythonWorker(self.python_path)
+    
+    def _replace_in_background(self, worker: PythonWorker):
+        async def replace():
+            self._idle.put_nowait(await self._replace(worker))
+        task = asyncio.create_task(replace())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _healthy(self, worker: PythonWorker) -> bool:
+        if not worker.alive:
+            return False
         try:
-            subprocess.run([command], capture_output=True)
-            return True
-        except (subprocess.CalledProcessError, FileNotFoundError):
+            response = await asyncio.wait_for(worker.request({"ping": True}), timeout=5)
+            return response.get("pong", False)
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
             return False
     
-    async def execute_command(self, command: Command, parsed_args: Dict[str, Any] = None) -> CommandResult:
-        start_time = datetime.now()
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval_ms / 1000)
+            # Only idle workers are checked, busy ones are checked when they return
+            for _ in range(self._idle.qsize()):
+                worker = self._idle.get_nowait()
+                if not await self._healthy(worker):
+                    logger.warning("Restarting unhealthy Python worker")
+                    worker = await self._replace(worker)
+                self._idle.put_nowait(worker)
+    
+    async def run(self, script_path: str, args: List[str]) -> CommandResult:
+        worker = await self._idle.get()
+        if not worker.alive:
+            logger.warning("Restarting crashed Python worker")
+            worker = await self._replace(worker)
+            if not worker.alive:
+                self._idle.put_nowait(worker)
+                return CommandResult(False, "", "Python worker could not be started")
         
+        completed = False
         try:
-            if command.environment == ExecutionEnvironment.PYTHON:
-                result = await self._execute_python(command, parsed_args)
-            elif command.environment == ExecutionEnvironment.AUTOHOTKEY:
-                result = await self._execute_ahk(command, parsed_args)
-            elif command.environment == ExecutionEnvironment.JAVA:
-                result = await self._execute_java(command, parsed_args)
-            elif command.environment == ExecutionEnvironment.NODEJS:
-                result = await self._execute_nodejs(command, parsed_args)
-            elif command.environment == ExecutionEnvironment.SYSTEM:
-                result = await self._execute_system(command, parsed_args)
+            response = await worker.request({"script_path": script_path, "args": args})
+            completed = True
+        except (ConnectionError, ValueError) as e:
+            logger.error(f"Python worker failed while running {script_path}: {e}")
+            return CommandResult(False, "", f"Python worker failed: {e}")
+        finally:
+            if completed:
+                self._idle.put_nowait(worker)
             else:
-                result = CommandResult(False, "", f"Unsupported execution environment: {command.environment}")
-        
-        except Exception as e:
-            logger.error(f"Error executing command {command.key}: {e}")
-            result = CommandResult(False, "", str(e))
-        
-        execution_time = (datetime.now() - start_time).total_seconds()
-        result.execution_time = execution_time
+                # The worker may still be busy or mid-response, never reuse it
+                self._replace_in_background(worker)
         
-        return result
+        if response["returncode"] == 0:
+            return CommandResult(True, response["stdout"].strip())
+        else:
+            return CommandResult(False, response["stdout"].strip(), response["stderr"].strip())
     
-    async def _execute_python(self, command: Command, parsed_args: Dict[str, Any] = None) -> CommandResult:
-        args = [self.python_path, command.script_path]
-        
-        # Add command line arguments
-        if command.args:
-            args.extend(command.args)
-        
-        # If we have parsed arguments, pass them as JSON
-        if parsed_args:
-            args.extend(["--parsed-args", json.dumps(parsed_args)])
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*(worker.stop() for worker in self._workers))
+        self._workers = []
+
+class ExecutableResolver:
+    """Resolves interpreter executables lazily and caches them on disk.
+
+    Each environment is resolved the first time it is used, with the Python
+    candidates probed concurrently. Cached paths stay valid while PATH, the
+    mtimes of its directories and the mtime of the resolved file are
+    unchanged, so a warm start spawns no processes at all.
+    """
+    
+    PYTHON_CANDIDATES = ["python", "python3", "py"]
+    
+    # Common AutoHotkey paths
+    AHK_CANDIDATES = [
+        r"C:\Program Files\AutoHotkey\AutoHotkey.exe",
+        r"C:\Program Files (x86)\AutoHotkey\AutoHotkey.exe",
+        "autohotkey.exe",
+        "ahk.exe"
+    ]
+    
+    FALLBACKS = {
+        ExecutionEnvironment.PYTHON: "python",
+        ExecutionEnvironment.AUTOHOTKEY: "autohotkey.exe",
+        ExecutionEnvironment.JAVA: "java",  # Assume java is in PATH
+        ExecutionEnvironment.NODEJS: "node"  # Assume node is in PATH
+    }
+    
+    def __init__(self, cache_file: str = "state/executables.json"):
+        self.cache_file = cache_file
+        self._resolved: Dict[ExecutionEnvironment, str] = {}
+        self._locks: Dict[ExecutionEnvironment, asyncio.Lock] = {}
+        self._cache: Optional[Dict[str, Any]] = None
+    
+    @staticmethod
+    def _path_key() -> str:
+        """Fingerprint PATH and its directories, which change when executables are added or removed"""
+        path = os.environ.get("PATH", "")
+        parts = [path]
+        for directory in path.split(os.pathsep):
+            try:
+                parts.append(f"{directory}={os.stat(directory).st_mtime_ns}")
+            except OSError:
+                parts.append(f"{directory}=missing")
+        return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+    
+    @staticmethod
+    def _file_mtime(executable: str) -> Optional[int]:
+        location = executable if os.path.exists(executable) else shutil.which(executable)
+        try:
+            return os.stat(location).st_mtime_ns if location else None
+        except OSError:
+            return None
+    
+    def _load_cache(self) -> Dict[str, Any]:
+        key = self._path_key()
+        try:
+            with open(self.cache_file, 'r') as f:
+                cache = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            cache = {}
+        if cache.get("key") != key:
+            cache = {"key": key, "executables": {}}
+        return cache
+    
+    def _save_cache(self):
+        os.makedirs(os.path.dirname(self.cache_file) or ".", exist_ok=True)
+        tmp_file = f"{self.cache_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(self._cache, f, indent=2)
+        os.replace(tmp_file, self.cache_file)
+    
+    async def resolve(self, environment: ExecutionEnvironment) -> str:
+        path = self._resolved.get(environment)
+        if path is not None:
+            return path
         
+        lock = self._locks.setdefault(environment, asyncio.Lock())
+        async with lock:
+            if environment in self._resolved:
+                return self._resolved[environment]
+            if self._cache is None:
+                self._cache = self._load_cache()
+            
+            entry = self._cache["executables"].get(environment.value)
+            if entry and entry["mtime"] == self._file_mtime(entry["path"]):
+                path = entry["path"]
+            else:
+                path = await self._discover(environment)
+                self._cache["executables"][environment.value] = {"path": path, "mtime": self._file_mtime(path)}
+                self._save_cache()
+                logger.info(f"Resolved {environment.value} executable: {path}")
+            
+            self._resolved[environment] = path
+            return path
+    
+    async def _discover(self, environment: ExecutionEnvironment) -> str:
+        if environment == ExecutionEnvironment.PYTHON:
+            probes = await asyncio.gather(*(self._probe(path) for path in self.PYTHON_CANDIDATES))
+            for path, works in zip(self.PYTHON_CANDIDATES, probes):
+                if works:
+                    return path
+        elif environment == ExecutionEnvironment.AUTOHOTKEY:
+            for path in self.AHK_CANDIDATES:
+                if os.path.exists(path) or shutil.which(path):
+                    return path
+        return self.FALLBACKS[environment]
+    
+    @staticmethod
+    async def _probe(path: str) -> bool:
+        # Skip the spawn entirely when the name is not even on PATH
+        if shutil.which(path) is None:
+            return False
         try:
             process = await asyncio.create_subprocess_exec(
-                *args,
+                path, "--version",
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            return await process.wait() == 0
+        except OSError:
+            return False
+
+class NodeHost:
+    """Resident Node.js process running workers/node_host.js.
+
+    Scripts are required once by the host and their exported handlers are
+    called for each request. Requests are multiplexed over stdio as
+    line-delimited JSON and matched to responses by id; lines that are not
+    responses are skipped. If the host exits or its output can no longer be
+    read, pending requests fail and the next request starts a new host.
+    """
+    
+    def __init__(self, node_path: str):
+        self.node_path = node_path
+        self.process: Optional[asyncio.subprocess.Process] = None
+        # Requests awaiting a response from the current process; each process has its own
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._reader: Optional[asyncio.Task] = None
+        self._start_lock = asyncio.Lock()
+    
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+    
+    async def start(self):
+        async with self._start_lock:
+            if self.alive:
+                return
+            self.process = await asyncio.create_subprocess_exec(
+                self.node_path, os.path.join(WORKERS_DIR, "node_host.js"),
+                stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.DEVNULL,
+                limit=16 * 1024 * 1024  # Responses carry the full handler output on one line
             )
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode == 0:
-                return CommandResult(True, stdout.decode().strip())
-            else:
-                return CommandResult(False, stdout.decode().strip(), stderr.decode().strip())
-        
-        except Exception as e:
-            return CommandResult(False, "", str(e))
+            # A new map, so the old reader only fails requests sent to the old process
+            self._pending = {}
+            self._reader = asyncio.create_task(self._read_responses(self.process, self._pending))
+            logger.info("Started resident Node.js host")
     
-    async def _execute_ahk(self, command: Command, parsed_args: Dict[str, Any] = None) -> CommandResult:
-        # For AHK scripts, we might need to create a temporary script with parameters
-        args = [self.ahk_path, command.script_path]
+    async def _read_responses(self, process: asyncio.subprocess.Process, pending: Dict[int, asyncio.Future]):
+        try:
+            while True:
+                line = await process.stdout.readline()
+                if not line:
+                    break
+                try:
+                    response = json.loads(line)
+                    request_id = response.get("id")
+                except (ValueError, AttributeError):
+                    # A handler writing to process.stdout directly; not a response
+                    logger.warning(f"Ignoring malformed line from Node.js host: {line[:200]!r}")
+                    continue
+                future = pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        finally:
+            if process.returncode is None:
+                # Without a reader nothing would ever answer, so restart the host
+                process.kill()
+            returncode = await process.wait()
+            error = ConnectionError(f"Node.js host exited with code {returncode}")
+            for future in pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            pending.clear()
+    
+    async def run(self, script_path: str, args: List[str], parsed_args: Dict[str, Any] = None) -> CommandResult:
+        await self.start()
+        process, pending = self.process, self._pending
+        self._next_id += 1
+        request_id = self._next_id
+        future = asyncio.get_running_loop().create_future()
+        pending[request_id] = future
         
-        if command.args:
-            args.extend(command.args)
-            
+        request = {"id": request_id, "script_path": script_path, "args": args, "parsed_args": parsed_args or {}}
         try:
-            process = await asyncio.create_subprocess_exec(
-                *args,
+            process.stdin.write((json.dumps(request) + "\n").encode())
+            await process.stdin.drain()
+            response = await future
+        except (ConnectionError, ValueError) as e:
+            return CommandResult(False, "", f"Node.js host failed: {e}")
+        finally:
+            pending.pop(request_id, None)
+        
+        if response.get("ok"):
+            return CommandResult(True, response.get("output", "").strip())
+        else:
+            return CommandResult(False, "", response.get("error", "Unknown Node.js host error"))
+    
+    async def close(self):
+        if self.alive:
+            # The host exits once its stdin is closed
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                self.process.kill()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+class JvmHost:
+    """Resident JVM running workers/JvmHost.java, similar in spirit to nailgun.
+
+    Jars and classes are loaded once by the host and stay hot. Each request
+    opens a loopback socket connection, sends one tab-separated line of
+    base64 fields and reads one response line back. Requests carry the
+    random token the host printed at startup, so other local processes
+    cannot use the port to run code. Cancelling a request closes its
+    connection, which interrupts the hosted thread. The host is started on
+    first use and restarted if it has exited.
+    """
+    
+    def __init__(self, java_path: str, startup_timeout_ms: int = 30000):
+        self.java_path = java_path
+        self.startup_timeout_ms = startup_timeout_ms
+        self.process: Optional[asyncio.subprocess.Process] = None
+        self.port: Optional[int] = None
+        self._token: Optional[str] = None
+        self._next_id = 0
+        self._start_lock = asyncio.Lock()
+    
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+    
+    async def start(self):
+        async with self._start_lock:
+            if self.alive:
+                return
+            # stdin stays open for the host's lifetime, it exits when the pipe closes
+            self.process = await asyncio.create_subprocess_exec(
+                self.java_path, os.path.join(WORKERS_DIR, "JvmHost.java"),
+                stdin=asyncio.subprocess.PIPE,
                 stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
+                stderr=asyncio.subprocess.DEVNULL
             )
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode == 0:
-                return CommandResult(True, stdout.decode().strip())
+            try:
+                line = await asyncio.wait_for(self.process.stdout.readline(), self.startup_timeout_ms / 1000)
+            except asyncio.TimeoutError:
+                line = b""
+            fields = line.split()
+            if len(fields) != 3 or fields[0] != b"PORT":
+                if self.alive:
+                    self.process.kill()
+                raise ConnectionError("JVM host did not start")
+            self.port, self._token = int(fields[1]), fields[2].decode()
+            logger.info(f"Started resident JVM host on port {self.port}")
+    
+    @staticmethod
+    def _encode(value: str) -> str:
+        return base64.b64encode(value.encode()).decode()
+    
+    async def run(self, target: str, args: List[str]) -> CommandResult:
+        try:
+            await self.start()
+            self._next_id += 1
+            request = "\t".join([self._token, str(self._next_id), self._encode(target)]
+                                + [self._encode(arg) for arg in args])
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port, limit=16 * 1024 * 1024)
+            try:
+                writer.write((request + "\n").encode())
+                await writer.drain()
+                line = await reader.readline()
+            finally:
+                writer.close()
+            if not line:
+                raise ConnectionError("JVM host closed the connection")
+            _, returncode, stdout, stderr = line.decode().rstrip("\n").split("\t")
+        except (OSError, ValueError) as e:
+            return CommandResult(False, "", f"JVM host failed: {e}")
+        
+        stdout = base64.b64decode(stdout).decode(errors="replace").strip()
+        stderr = base64.b64decode(stderr).decode(errors="replace").strip()
+        if int(returncode) == 0:
+            return CommandResult(True, stdout)
+        else:
+            return CommandResult(False, stdout, stderr)
+    
+    async def close(self):
+        if self.alive:
+            # The host exits once its stdin is closed
+            self.process.stdin.close()
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout=2)
+            except asyncio.TimeoutError:
+                self.process.kill()
+
+class ExecutionScheduler:
+    """Bounded-concurrency admission for command execution with priority lanes.
+
+    A command starts once a global slot, a slot for its ExecutionEnvironment
+    and a slot for the command itself are all free. reserved_high_slots of
+    the global and of each environment's slots are kept for HIGH priority
+    commands, so latency-critical commands never wait behind slow ones.
+    Commands that cannot start wait by priority, then arrival order, and at
+    most max_queue may wait at once; further non-HIGH submissions are
+    rejected so a burst cannot pile up unbounded work behind a saturated
+    machine.
+    """
+    
+    PRIORITY_ORDER = {CommandPriority.HIGH: 0, CommandPriority.NORMAL: 1, CommandPriority.LOW: 2}
+    
+    def __init__(self, max_concurrency: Optional[int] = None, max_queue: int = 32, command_limit: int = 2,
+                 environment_limits: Dict[str, int] = None, reserved_high_slots: int = 1):
+        self.max_concurrency = max_concurrency or os.cpu_count() or 4
+        self.max_queue = max_queue
+        self.command_limit = command_limit
+        self.environment_limits = {ExecutionEnvironment(env): limit
+                                   for env, limit in (environment_limits or {}).items()}
+        self.reserved_high_slots = reserved_high_slots
+        self._running = 0
+        self._running_by_environment: Dict[ExecutionEnvironment, int] = {}
+        self._running_by_command: Dict[str, int] = {}
+        self._waiters: List[Tuple[int, int, Command, asyncio.Future]] = []
+        self._sequence = 0
+    
+    def _limit(self, limit: int, command: Command) -> int:
+        # Other priorities leave the reserved slots free, but can always use at least one
+        if command.priority == CommandPriority.HIGH:
+            return limit
+        return max(1, limit - self.reserved_high_slots)
+    
+    def _can_start(self, command: Command) -> bool:
+        environment_limit = self.environment_limits.get(command.environment, self.max_concurrency)
+        command_limit = command.max_concurrency or self.command_limit
+        return (self._running < self._limit(self.max_concurrency, command)
+                and self._running_by_environment.get(command.environment, 0) < self._limit(environment_limit, command)
+                and self._running_by_command.get(command.key, 0) < command_limit)
+    
+    def _start(self, command: Command):
+        self._running += 1
+        self._running_by_environment[command.environment] = self._running_by_environment.get(command.environment, 0) + 1
+        self._running_by_command[command.key] = self._running_by_command.get(command.key, 0) + 1
+    
+    async def acquire(self, command: Command) -> Optional[float]:
+        """Wait for a slot and return the queue wait in seconds, or None if the queue is full"""
+        start_time = time.perf_counter()
+        if self._can_start(command):
+            self._start(command)
+            return 0.0
+        if len(self._waiters) >= self.max_queue and command.priority != CommandPriority.HIGH:
+            return None
+        
+        self._sequence += 1
+        waiter = (self.PRIORITY_ORDER[command.priority], self._sequence, command,
+                  asyncio.get_running_loop().create_future())
+        bisect.insort(self._waiters, waiter, key=lambda w: w[:2])
+        try:
+            await waiter[3]
+        except asyncio.CancelledError:
+            if waiter[3].done() and not waiter[3].cancelled():
+                # The slot was granted just as we were cancelled, hand it on
+                self.release(command)
             else:
-                return CommandResult(False, stdout.decode().strip(), stderr.decode().strip())
+                self._waiters.remove(waiter)
+            raise
+        return time.perf_counter() - start_time
+    
+    def release(self, command: Command):
+        self._running -= 1
+        self._running_by_environment[command.environment] -= 1
+        self._running_by_command[command.key] -= 1
         
-        except Exception as e:
-            return CommandResult(False, "", str(e))
+        # Start every waiter whose limits now allow it, highest priority first
+        for waiter in list(self._waiters):
+            waiting_command, future = waiter[2], waiter[3]
+            if self._can_start(waiting_command):
+                self._waiters.remove(waiter)
+                self._start(waiting_command)
+                future.set_result(None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._running,
+            "queued": len(self._waiters),
+            "running_by_environment": {env.value: count for env, count in self._running_by_environment.items()},
+        }
+
+class OutputBuffer:
+    """Keeps the most recent max_chars of a command's output"""
+    
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.truncated = False
+        self._chunks: deque = deque()
+        self._size = 0
+    
+    def append(self, text: str):
+        self._chunks.append(text)
+        self._size += len(text)
+        while self._size > self.max_chars:
+            excess = self._size - self.max_chars
+            head = self._chunks[0]
+            if len(head) <= excess:
+                self._chunks.popleft()
+                self._size -= len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                self._size -= excess
+            self.truncated = True
+    
+    def getvalue(self) -> str:
+        return "".join(self._chunks)
+
+class CommandStream:
+    """Async iterator over the output chunks of a running command.
+
+    Chunks are handed over through a bounded queue, so a slow consumer
+    pauses reading from the process instead of buffering its output in
+    memory. Once iteration ends, result holds the final CommandResult.
+    Call aclose() to stop the command when abandoning the stream early.
+    """
+    
+    def __init__(self, engine: "ExecutionEngine", command: Command, parsed_args: Dict[str, Any] = None,
+                 max_chunks: int = 64):
+        self.result: Optional[CommandResult] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_chunks)
+        self._task = asyncio.create_task(engine.execute_command(command, parsed_args, on_output=self._queue.put))
+    
+    def __aiter__(self) -> "CommandStream":
+        return self
+    
+    async def __anext__(self) -> OutputChunk:
+        if not self._queue.empty():
+            return self._queue.get_nowait()
+        if self._task.done():
+            self.result = self._task.result()
+            raise StopAsyncIteration
+        
+        next_chunk = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait({next_chunk, self._task}, return_when=asyncio.FIRST_COMPLETED)
+        if next_chunk in done:
+            return next_chunk.result()
+        next_chunk.cancel()
+        return await self.__anext__()
+    
+    async def aclose(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+class ResultCache:
+    """LRU cache of CommandResults for commands marked cacheable.
+
+    Entries are keyed on the command key plus its normalized parsed args
+    (only the names listed in cacheable.key, when given) and expire after
+    the command's cacheable.ttl_ms, or default_ttl_ms when it sets none.
+    Only successful results are stored. Results are copied on the way in
+    and out, so callers cannot change a cached entry.
+    """
+    
+    def __init__(self, max_entries: int = 256, default_ttl_ms: int = 60000):
+        self.max_entries = max_entries
+        self.default_ttl_ms = default_ttl_ms
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, CommandResult]]" = OrderedDict()
+    
+    @staticmethod
+    def _normalize(value: Any) -> Any:
+        if isinstance(value, str):
+            return " ".join(value.lower().split())
+        if isinstance(value, dict):
+            return {k: ResultCache._normalize(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [ResultCache._normalize(v) for v in value]
+        return value
+    
+    def make_key(self, command: Command, parsed_args: Dict[str, Any] = None) -> str:
+        args = parsed_args or {}
+        key_args = command.cacheable.get("key")
+        if key_args is not None:
+            args = {name: args.get(name) for name in key_args}
+        return f"{command.key}:{json.dumps(self._normalize(args), sort_keys=True, default=str)}"
+    
+    def get(self, key: str) -> Optional[CommandResult]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return replace(entry[1], metadata=copy.deepcopy(entry[1].metadata))
+    
+    def put(self, key: str, result: CommandResult, ttl_ms: Optional[int] = None):
+        if ttl_ms is None:
+            ttl_ms = self.default_ttl_ms
+        self._entries[key] = (time.monotonic() + ttl_ms / 1000, replace(result, metadata=copy.deepcopy(result.metadata)))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, command_key: Optional[str] = None) -> int:
+        """Drop the cached results of one command, or of every command, returning how many were dropped"""
+        if command_key is None:
+            dropped = len(self._entries)
+            self._entries.clear()
+            return dropped
+        prefix = f"{command_key}:"
+        keys = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0
+        }
+
+class StageTimings:
+    """Milliseconds a runner spent in each stage of one execution.
+
+    spawn covers starting or reaching whatever runs the command (process,
+    worker, resident host, module import), run covers the command itself
+    and decode covers turning its output into a CommandResult.
+    """
+    
+    STAGES = ("spawn", "run", "decode")
+    
+    def __init__(self):
+        self.elapsed = dict.fromkeys(self.STAGES, 0.0)
+    
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.elapsed[name] += time.perf_counter() - start
+    
+    def as_dict(self) -> Dict[str, float]:
+        return {f"{name}_ms": round(seconds * 1000, 3) for name, seconds in self.elapsed.items()}
+
+class RunnerBackend:
+    """Interface for the ways ExecutionEngine can run a command.
+
+    The engine keeps an ordered list of runners per ExecutionEnvironment and
+    uses the first one that handles the command. Runners record their work
+    in the StageTimings they are given; the engine attaches those timings
+    and the runner name to the result metadata.
+    """
+    
+    name = "runner"
+    
+    def handles(self, command: Command, streaming: bool = False) -> bool:
+        """Whether this runner takes the command; streaming is set when a consumer wants live output"""
+        return True
+    
+    def can_stream(self, command: Command) -> bool:
+        return False
+    
+    async def run(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings) -> CommandResult:
+        raise NotImplementedError
     
-    async def _execute_java(self, command: Command, parsed_args: Dict[str, Any] = None) -> CommandResult:
-        # Assume the script_path is a compiled Java class or jar
-        if command.script_path.endswith('.jar'):
-            args = [self.java_path, '-jar', command.script_path]
+    async def stream(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings,
+                     on_output: Callable[[OutputChunk], Awaitable[None]]) -> CommandResult:
+        raise NotImplementedError
+    
+    async def close(self):
+        """Stop any resident processes the runner started"""
+        pass
+
+class OneShotRunner(RunnerBackend):
+    """Starts a new process for every execution of a command"""
+    
+    name = "one_shot"
+    
+    def __init__(self, executables: "ExecutableResolver", kill_grace_ms: int = 2000, max_output_chars: int = 1000000):
+        self.executables = executables
+        # How long a timed out or cancelled process gets to exit after terminate()
+        self.kill_grace_ms = kill_grace_ms
+        # Output of each stream kept for the final CommandResult; older output is dropped
+        self.max_output_chars = max_output_chars
+    
+    def can_stream(self, command: Command) -> bool:
+        return True
+    
+    async def process_args(self, command: Command, parsed_args: Dict[str, Any] = None) -> List[str]:
+        """Build the argv for running a command as a one-shot process"""
+        if command.environment == ExecutionEnvironment.SYSTEM:
+            # Direct system command execution
+            return command.script_path.split() + (command.args or [])
+        
+        executable = await self.executables.resolve(command.environment)
+        if command.environment == ExecutionEnvironment.JAVA and command.script_path.endswith('.jar'):
+            args = [executable, '-jar', command.script_path]
         else:
-            args = [self.java_path, command.script_path]
-            
+            # For AHK scripts, we might need to create a temporary script with parameters
+            args = [executable, command.script_path]
+        
+        # Add command line arguments
         if command.args:
             args.extend(command.args)
+        
+        # If we have parsed arguments, pass them as JSON
+        if parsed_args and command.environment in (ExecutionEnvironment.PYTHON, ExecutionEnvironment.NODEJS):
+            args.extend(["--parsed-args", json.dumps(parsed_args)])
+        return args
+    
+    async def _spawn(self, command: Command, parsed_args: Dict[str, Any]) -> asyncio.subprocess.Process:
+        args = await self.process_args(command, parsed_args)
+        return await asyncio.create_subprocess_exec(
+            *args,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+    
+    async def run(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings) -> CommandResult:
+        return await self._execute(command, parsed_args, timings, None)
+    
+    async def stream(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings,
+                     on_output: Callable[[OutputChunk], Awaitable[None]]) -> CommandResult:
+        """Run the process, passing output to on_output as it arrives"""
+        return await self._execute(command, parsed_args, timings, on_output)
+    
+    async def _execute(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings,
+                       on_output: Optional[Callable[[OutputChunk], Awaitable[None]]]) -> CommandResult:
+        """Run the process, reading its output in chunks so at most max_output_chars per stream is kept"""
+        with timings.stage("spawn"):
+            process = await self._spawn(command, parsed_args)
+        captured = {"stdout": OutputBuffer(self.max_output_chars), "stderr": OutputBuffer(self.max_output_chars)}
+        
+        async def pump(reader: asyncio.StreamReader, stream: str):
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            while True:
+                data = await reader.read(4096)
+                with timings.stage("decode"):
+                    text = decoder.decode(data, final=not data)
+                if text:
+                    captured[stream].append(text)
+                    if on_output is not None:
+                        # Awaiting the consumer pauses reading, so a slow consumer throttles the process
+                        await on_output(OutputChunk(stream, text))
+                if not data:
+                    break
+        
+        with timings.stage("run"):
+            try:
+                await asyncio.gather(pump(process.stdout, "stdout"), pump(process.stderr, "stderr"))
+                await process.wait()
+            except asyncio.CancelledError:
+                await self.terminate(process)
+                raise
+        # Decoding happened while the process ran; report it only once
+        timings.elapsed["run"] -= timings.elapsed["decode"]
+        
+        stdout, stderr = captured["stdout"].getvalue().strip(), captured["stderr"].getvalue().strip()
+        metadata = {"streamed": True} if on_output is not None else {}
+        if captured["stdout"].truncated or captured["stderr"].truncated:
+            metadata["output_truncated"] = True
+        if process.returncode == 0:
+            return CommandResult(True, stdout, metadata=metadata)
+        else:
+            return CommandResult(False, stdout, stderr, metadata=metadata)
+    
+    async def terminate(self, process: asyncio.subprocess.Process):
+        """Terminate a process, killing it if it outlives the grace period"""
+        if process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), self.kill_grace_ms / 1000)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+
+class PooledPythonRunner(RunnerBackend):
+    """Runs PYTHON commands on a PythonWorkerPool started on first use.
+
+    Commands marked streaming skip the pool when a consumer wants live
+    output, since workers only return output once the script finishes.
+    """
+    
+    name = "python_pool"
+    
+    def __init__(self, executables: "ExecutableResolver", enabled: bool = False, **pool_settings):
+        self.executables = executables
+        self.enabled = enabled
+        self.pool_settings = pool_settings
+        self.pool: Optional[PythonWorkerPool] = None
+        self._pool_lock = asyncio.Lock()
+    
+    def handles(self, command: Command, streaming: bool = False) -> bool:
+        return self.enabled and not (streaming and command.streaming)
+    
+    async def _get_pool(self) -> PythonWorkerPool:
+        async with self._pool_lock:
+            if self.pool is None:
+                python_path = await self.executables.resolve(ExecutionEnvironment.PYTHON)
+                self.pool = PythonWorkerPool(python_path, **self.pool_settings)
+                await self.pool.start()
+        return self.pool
+    
+    async def run(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings) -> CommandResult:
+        with timings.stage("spawn"):
+            pool = await self._get_pool()
+        args = list(command.args or [])
+        if parsed_args:
+            args.extend(["--parsed-args", json.dumps(parsed_args)])
+        # Workers send their output back already decoded
+        with timings.stage("run"):
+            return await pool.run(command.script_path, args)
+    
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+class InProcessRunner(RunnerBackend):
+    """Calls a PYTHON script's run(args) entry point directly, without a new process.
+
+    Modules are imported once, in the default thread pool, and reloaded
+    only when the file changes. They are registered in sys.modules under a
+    name derived from the script's full path, so scripts sharing a file
+    name do not collide and dataclasses and pickling work in them.
+    Coroutine entry points are awaited on the event loop, plain functions
+    run in the default thread pool so they cannot block it. The return
+    value may be a CommandResult or anything printable.
+    """
+    
+    name = "in_process"
+    
+    def __init__(self):
+        # Modules loaded for in_process commands: script_path -> (mtime, module)
+        self._modules: Dict[str, Tuple[float, Any]] = {}
+        # Serializes imports so concurrent first calls load a script once
+        self._load_lock = threading.Lock()
+    
+    def handles(self, command: Command, streaming: bool = False) -> bool:
+        return command.in_process
+    
+    def _cached_module(self, script_path: str) -> Optional[Any]:
+        cached = self._modules.get(script_path)
+        if cached and cached[0] == os.path.getmtime(script_path):
+            return cached[1]
+        return None
+    
+    @staticmethod
+    def _module_name(script_path: str) -> str:
+        path = os.path.abspath(script_path)
+        stem = re.sub(r"\W", "_", os.path.splitext(os.path.basename(path))[0])
+        return f"assistant_command_{stem}_{hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]}"
+    
+    def _load_module(self, script_path: str) -> Any:
+        """Import a command script once, reloading it only when the file changes"""
+        with self._load_lock:
+            mtime = os.path.getmtime(script_path)
+            module = self._cached_module(script_path)
+            if module is not None:
+                return module
             
-        try:
-            process = await asyncio.create_subprocess_exec(
-                *args,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode == 0:
-                return CommandResult(True, stdout.decode().strip())
+            module_name = self._module_name(script_path)
+            spec = importlib.util.spec_from_file_location(module_name, script_path)
+            if spec is None or spec.loader is None:
+                raise ImportError(f"Cannot load command module from {script_path}")
+            module = importlib.util.module_from_spec(spec)
+            # Registered first, as import does, so the module can find itself while it runs
+            previous = sys.modules.get(module_name)
+            sys.modules[module_name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                if previous is not None:
+                    sys.modules[module_name] = previous
+                else:
+                    sys.modules.pop(module_name, None)
+                raise
+            self._modules[script_path] = (mtime, module)
+            return module
+    
+    async def run(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings) -> CommandResult:
+        with timings.stage("spawn"):
+            module = self._cached_module(command.script_path)
+            if module is None:
+                # Importing runs the script's top-level code, which must not block the event loop
+                loop = asyncio.get_running_loop()
+                module = await loop.run_in_executor(None, self._load_module, command.script_path)
+        entry_point = getattr(module, "run", None)
+        if not callable(entry_point):
+            return CommandResult(False, "", f"{command.script_path} has no run(args) entry point")
+        
+        args = dict(parsed_args or {})
+        with timings.stage("run"):
+            if asyncio.iscoroutinefunction(entry_point):
+                output = await entry_point(args)
             else:
-                return CommandResult(False, stdout.decode().strip(), stderr.decode().strip())
+                loop = asyncio.get_running_loop()
+                output = await loop.run_in_executor(None, functools.partial(entry_point, args))
         
-        except Exception as e:
-            return CommandResult(False, "", str(e))
+        with timings.stage("decode"):
+            if isinstance(output, CommandResult):
+                return output
+            return CommandResult(True, "" if output is None else str(output))
+
+class NodeHostRunner(RunnerBackend):
+    """Runs in_process NODEJS commands on a resident NodeHost"""
+    
+    name = "node_host"
+    
+    def __init__(self, executables: "ExecutableResolver"):
+        self.executables = executables
+        self.host: Optional[NodeHost] = None
+    
+    def handles(self, command: Command, streaming: bool = False) -> bool:
+        return command.in_process
+    
+    async def run(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings) -> CommandResult:
+        with timings.stage("spawn"):
+            if self.host is None:
+                self.host = NodeHost(await self.executables.resolve(ExecutionEnvironment.NODEJS))
+            await self.host.start()
+        # The host decodes its JSON response as part of the round trip
+        with timings.stage("run"):
+            return await self.host.run(command.script_path, command.args or [], parsed_args)
+    
+    async def close(self):
+        if self.host is not None:
+            await self.host.close()
+            self.host = None
+
+class JvmHostRunner(RunnerBackend):
+    """Runs in_process JAVA commands on a resident JvmHost"""
+    
+    name = "jvm_host"
     
-    async def _execute_nodejs(self, command: Command, parsed_args: Dict[str, Any] = None) -> CommandResult:
-        args = [self.node_path, command.script_path]
+    def __init__(self, executables: "ExecutableResolver"):
+        self.executables = executables
+        self.host: Optional[JvmHost] = None
+    
+    def handles(self, command: Command, streaming: bool = False) -> bool:
+        return command.in_process
+    
+    async def run(self, command: Command, parsed_args: Dict[str, Any], timings: StageTimings) -> CommandResult:
+        try:
+            with timings.stage("spawn"):
+                if self.host is None:
+                    self.host = JvmHost(await self.executables.resolve(ExecutionEnvironment.JAVA))
+                await self.host.start()
+        except (OSError, ConnectionError) as e:
+            return CommandResult(False, "", f"JVM host failed: {e}")
+        
+        args = list(command.args or [])
+        if parsed_args:
+            args.extend(["--parsed-args", json.dumps(parsed_args)])
+        # The host decodes its response as part of the round trip
+        with timings.stage("run"):
+            return await self.host.run(command.script_path, args)
+    
+    async def close(self):
+        if self.host is not None:
+            await self.host.close()
+            self.host = None
+
+class ExecutionEngine:
+    def __init__(self, python_pool: Dict[str, Any] = None, scheduler: Dict[str, Any] = None,
+                 default_timeout_ms: Optional[int] = None, kill_grace_ms: int = 2000,
+                 max_output_chars: int = 1000000, result_cache: Dict[str, Any] = None,
+                 executable_cache: str = "state/executables.json"):
+        # Commands without their own timeout_ms use the default; None waits forever
+        self.default_timeout_ms = default_timeout_ms
+        
+        # Concurrency limits and the bounded wait queue for all executions
+        self.scheduler = ExecutionScheduler(**(scheduler or {}))
+        
+        # Recent results of cacheable commands
+        self.result_cache = ResultCache(**(result_cache or {}))
+        
+        # Interpreter paths are resolved on first use of each environment
+        self.executables = ExecutableResolver(executable_cache)
+        
+        # Runners per environment, tried in order; resident ones start on first use
+        one_shot = OneShotRunner(self.executables, kill_grace_ms, max_output_chars)
+        self.runners: Dict[ExecutionEnvironment, List[RunnerBackend]] = {
+            ExecutionEnvironment.PYTHON: [
+                InProcessRunner(),
+                PooledPythonRunner(self.executables, **(python_pool or {})),
+                one_shot
+            ],
+            ExecutionEnvironment.AUTOHOTKEY: [one_shot],
+            ExecutionEnvironment.JAVA: [JvmHostRunner(self.executables), one_shot],
+            ExecutionEnvironment.NODEJS: [NodeHostRunner(self.executables), one_shot],
+            ExecutionEnvironment.SYSTEM: [one_shot],
+        }
+    
+    def register_runner(self, environment: ExecutionEnvironment, runner: RunnerBackend):
+        """Add a runner ahead of the existing ones for an environment"""
+        self.runners.setdefault(environment, []).insert(0, runner)
+    
+    def select_runner(self, command: Command, streaming: bool = False) -> Optional[RunnerBackend]:
+        for runner in self.runners.get(command.environment, []):
+            if runner.handles(command, streaming):
+                return runner
+        return None
+    
+    async def shutdown(self):
+        """Stop any resident worker processes"""
+        runners = {id(runner): runner for runners in self.runners.values() for runner in runners}
+        for runner in runners.values():
+            await runner.close()
+    
+    async def execute_command(self, command: Command, parsed_args: Dict[str, Any] = None,
+                              on_output: Optional[Callable[[OutputChunk], Awaitable[None]]] = None) -> CommandResult:
+        """Run a command under the scheduler.
+
+        With on_output, output is passed along as it is produced: streamed
+        from one-shot processes, or in one piece once other runners finish.
+        Cacheable commands answer from the result cache when they can.
+        """
+        cache_key = None
+        if command.cacheable is not None:
+            cache_key = self.result_cache.make_key(command, parsed_args)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                if on_output is not None and cached.output:
+                    await on_output(OutputChunk("stdout", cached.output))
+                return replace(cached, execution_time=0.0, metadata={**(cached.metadata or {}), "cache_hit": True})
+        
+        queue_wait = await self.scheduler.acquire(command)
+        if queue_wait is None:
+            logger.warning(f"Execution queue full, rejecting command {command.key}")
+            return CommandResult(False, "", "Too many commands are queued, try again shortly",
+                                 metadata={"queue_full": True})
         
-        if command.args:
-            args.extend(command.args)
-            
         try:
-            process = await asyncio.create_subprocess_exec(
-                *args,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode == 0:
-                return CommandResult(True, stdout.decode().strip())
-            else:
-                return CommandResult(False, stdout.decode().strip(), stderr.decode().strip())
+            result = await self._run_command(command, parsed_args, on_output)
+        finally:
+            self.scheduler.release(command)
         
-        except Exception as e:
-            return CommandResult(False, "", str(e))
+        result.metadata = {**(result.metadata or {}), "queue_wait_ms": round(queue_wait * 1000, 3)}
+        if cache_key is not None and result.success:
+            self.result_cache.put(cache_key, result, command.cacheable.get("ttl_ms"))
+        return result
     
-    async def _execute_system(self, command: Command, parsed_args: Dict[str, Any] = None) -> CommandResult:
-        # Direct system command execution
+    def invalidate_cache(self, command_key: Optional[str] = None) -> int:
+        """Forget cached results for one command, or for all commands"""
+        return self.result_cache.invalidate(command_key)
+    
+    async def _run_command(self, command: Command, parsed_args: Dict[str, Any] = None,
+                           on_output: Optional[Callable[[OutputChunk], Awaitable[None]]] = None) -> CommandResult:
+        """Run a command on its runner, applying the timeout.
+
+        Cancellation (including a timeout) terminates one-shot processes,
+        replaces an interrupted Python worker and interrupts the JVM host
+        thread running the command. Work already handed to the Node.js host
+        or to an in-process thread, or JVM code that ignores interrupts,
+        cannot be stopped and runs to completion in the background.
+        """
+        start_time = datetime.now()
+        timeout_ms = command.timeout_ms or self.default_timeout_ms
+        runner = self.select_runner(command, on_output is not None)
+        if runner is None:
+            return CommandResult(False, "", f"Unsupported execution environment: {command.environment}")
+        streaming = on_output is not None and runner.can_stream(command)
+        timings = StageTimings()
+        
         try:
-            args = command.script_path.split() + (command.args or [])
-            process = await asyncio.create_subprocess_exec(
-                *args,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, stderr = await process.communicate()
-            
-            if process.returncode == 0:
-                return CommandResult(True, stdout.decode().strip())
+            if streaming:
+                run = runner.stream(command, parsed_args, timings, on_output)
             else:
-                return CommandResult(False, stdout.decode().strip(), stderr.decode().strip())
+                run = runner.run(command, parsed_args, timings)
+            if timeout_ms:
+                result = await asyncio.wait_for(run, timeout_ms / 1000)
+            else:
+                result = await run
+        
+        except asyncio.TimeoutError:
+            logger.error(f"Command {command.key} timed out after {timeout_ms} ms")
+            result = CommandResult(False, "", f"Command timed out after {timeout_ms} ms", metadata={"timed_out": True})
         
         except Exception as e:
-            return CommandResult(False, "", str(e))
+            logger.error(f"Error executing command {command.key}: {e}")
+            result = CommandResult(False, "", str(e))
+        
+        execution_time = (datetime.now() - start_time).total_seconds()
+        result.execution_time = execution_time
+        result.metadata = {**(result.metadata or {}), "runner": runner.name, "timings": timings.as_dict()}
+        
+        if on_output is not None and not streaming and result.output:
+            await on_output(OutputChunk("stdout", result.output))
+        
+        return result
+    
+    def stream_command(self, command: Command, parsed_args: Dict[str, Any] = None, max_chunks: int = 64) -> "CommandStream":
+        """Start a command and return an async iterator over its output chunks"""
+        return CommandStream(self, command, parsed_args, max_chunks)
 
-class AIParser:
-    """Interface for AI-powered command parsing"""
+class ParserBackend:
+    """Interface for the model behind AIParser.
+
+    parse_batch receives (user_input, command) pairs and returns one dict
+    of parsed parameters per pair, in order. A remote LLM backend would
+    send the whole batch in a single request.
+    """
     
-    def __init__(self):
-        # This would integrate with Claude/GPT-4 APIs
-        # For now, this is a placeholder for the AI integration
+    async def parse_batch(self, requests: List[Tuple[str, Command]]) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+    
+    async def close(self):
         pass
+
+class LocalParserBackend(ParserBackend):
+    """Deterministic offline stand-in for an LLM backend.
+
+    Pulls the numbers out of the utterance and takes the command keyword
+    it opens with as the action and the rest as the target. Enough to
+    exercise batching and benchmark throughput without network access.
+    """
+    
+    NUMBER = re.compile(r"[-+]?\d+(?:\.\d+)?")
+    
+    async def parse_batch(self, requests: List[Tuple[str, Command]]) -> List[Dict[str, Any]]:
+        return [self.parse(user_input, command) for user_input, command in requests]
+    
+    def parse(self, user_input: str, command: Command) -> Dict[str, Any]:
+        text = user_input.lower()
+        parsed: Dict[str, Any] = {"raw_input": user_input, "command_key": command.key}
+        
+        numbers = [float(n) if "." in n else int(n) for n in self.NUMBER.findall(text)]
+        if numbers:
+            parsed["numbers"] = numbers
+        
+        hits = [(text.find(keyword.lower()), keyword.lower()) for keyword in command.keywords if keyword.lower() in text]
+        if hits:
+            # Earliest keyword wins, the longest one when several start at the same place
+            start, keyword = min(hits, key=lambda hit: (hit[0], -len(hit[1])))
+            parsed["action"] = keyword
+            target = text[start + len(keyword):].strip(" .!?")
+            if target:
+                parsed["target"] = target
+        return parsed
+
+@dataclass
+class PendingParse:
+    user_input: str
+    command: Command
+    future: asyncio.Future
+    waiters: int = 0
+    # Whether any caller wants the result learned as a template
+    learn: bool = False
+
+@dataclass(frozen=True)
+class TemplateSlot:
+    index: int
+
+@dataclass(frozen=True)
+class TemplateText:
+    pieces: Tuple[Union[str, TemplateSlot], ...]
+
+@dataclass(frozen=True)
+class TemplateInput:
+    """Stands for the utterance being filled; unlike a string it cannot collide with an argument value"""
+
+@dataclass
+class LearnedTemplate:
+    result: Any
+    observations: int = 1
+
+class TemplateCache:
+    """Parse results learned per utterance template, filled locally for new slot values.
+
+    An utterance's template replaces its numbers, and any entity listed in
+    the command's metadata (e.g. common_apps), with slots. After a
+    successful parse the result is generalized by replacing the slot values
+    it contains with slot references. A template is only served once
+    min_observations parses produced the same generalized result, which
+    keeps out results with values derived from the slots (e.g. minutes
+    converted to seconds). Utterances whose slot values also appear in
+    their fixed text, or repeat, are not learned because the result would
+    be ambiguous.
+    """
+    
+    NUMBER = re.compile(r"(?<![\w.])[-+]?\d+(?:\.\d+)?(?![\w.])")
+    RAW_INPUT = "raw_input"
+    
+    def __init__(self, max_templates: int = 1024, min_observations: int = 2):
+        self.max_templates = max_templates
+        self.min_observations = min_observations
+        self.hits = 0
+        self.misses = 0
+        self._templates: "OrderedDict[Tuple[str, str], LearnedTemplate]" = OrderedDict()
+        # Compiled entity alternations per command key
+        self._entities: Dict[str, Optional["re.Pattern"]] = {}
+    
+    def _entity_pattern(self, command: Command) -> Optional["re.Pattern"]:
+        if command.key not in self._entities:
+            groups = []
+            for name, values in (command.metadata or {}).items():
+                if isinstance(values, list) and values and all(isinstance(v, str) for v in values):
+                    alternation = "|".join(re.escape(v.lower()) for v in sorted(values, key=len, reverse=True))
+                    groups.append(f"(?P<{name}>{alternation})")
+            self._entities[command.key] = re.compile(rf"\b(?:{'|'.join(groups)})\b") if groups else None
+        return self._entities[command.key]
+    
+    def _abstract(self, user_input: str, command: Command) -> Optional[Tuple[str, List[Tuple[str, Any]]]]:
+        """Split an utterance into its template and slot (text, value) pairs, or None if ambiguous"""
+        text = " ".join(user_input.lower().split()).rstrip(".!?")
+        spans = []
+        entity_pattern = self._entity_pattern(command)
+        if entity_pattern is not None:
+            for match in entity_pattern.finditer(text):
+                spans.append((match.start(), match.end(), match.lastgroup, match.group()))
+        for match in self.NUMBER.finditer(text):
+            if not any(start < match.end() and match.start() < end for start, end, _, _ in spans):
+                number = match.group()
+                spans.append((match.start(), match.end(), "number", float(number) if "." in number else int(number)))
+        spans.sort()
+        
+        template, literal, slots, position = [], [], [], 0
+        for start, end, slot_type, value in spans:
+            template.append(text[position:start])
+            literal.append(text[position:start])
+            template.append(f"{{{slot_type}}}")
+            slots.append((text[start:end], value))
+            position = end
+        template.append(text[position:])
+        literal.append(text[position:])
+        
+        fixed_text = "\x00".join(literal)
+        slot_texts = [slot_text for slot_text, _ in slots]
+        if len(set(slot_texts)) != len(slot_texts) or any(slot_text in fixed_text for slot_text in slot_texts):
+            return None
+        return "".join(template), slots
+    
+    def _generalize(self, value: Any, slots: List[Tuple[str, Any]], key: Optional[str] = None) -> Any:
+        if key == self.RAW_INPUT:
+            return TemplateInput()
+        if isinstance(value, dict):
+            return {k: self._generalize(v, slots, k) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._generalize(v, slots) for v in value]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            for index, (_, slot_value) in enumerate(slots):
+                if isinstance(slot_value, (int, float)) and slot_value == value:
+                    return TemplateSlot(index)
+            return value
+        if isinstance(value, str) and slots:
+            for index, (slot_text, _) in enumerate(slots):
+                if value.lower() == slot_text:
+                    return TemplateSlot(index)
+            indexes = {slot_text: index for index, (slot_text, _) in enumerate(slots)}
+            pattern = "|".join(rf"(?<![\w.]){re.escape(slot_text)}(?![\w.])" for slot_text in indexes)
+            pieces: List[Union[str, TemplateSlot]] = []
+            position = 0
+            for match in re.finditer(pattern, value, re.IGNORECASE):
+                pieces.append(value[position:match.start()])
+                pieces.append(TemplateSlot(indexes[match.group().lower()]))
+                position = match.end()
+            if pieces:
+                pieces.append(value[position:])
+                return TemplateText(tuple(pieces))
+        return value
     
-    async def parse_command(self, user_input: str, command: Command) -> Dict[str, Any]:
-        """Parse natural language command into structured parameters"""
-        # This would call Claude or GPT-4 to parse complex commands
-        # For now, return a basic parse
-        return {"raw_input": user_input, "command_key": command.key}
+    def _instantiate(self, template: Any, slots: List[Tuple[str, Any]], user_input: str) -> Any:
+        if isinstance(template, TemplateInput):
+            return user_input
+        if isinstance(template, dict):
+            return {k: self._instantiate(v, slots, user_input) for k, v in template.items()}
+        if isinstance(template, list):
+            return [self._instantiate(v, slots, user_input) for v in template]
+        if isinstance(template, TemplateSlot):
+            return slots[template.index][1]
+        if isinstance(template, TemplateText):
+            return "".join(slots[p.index][0] if isinstance(p, TemplateSlot) else p for p in template.pieces)
+        return template
+    
+    def learn(self, user_input: str, command: Command, result: Dict[str, Any]):
+        abstraction = self._abstract(user_input, command)
+        if abstraction is None:
+            return
+        template, slots = abstraction
+        key = (command.key, template)
+        generalized = self._generalize(result, slots)
+        learned = self._templates.get(key)
+        if learned is not None and learned.result == generalized:
+            learned.observations += 1
+        else:
+            # A different generalization means the last one did not hold; start over
+            self._templates[key] = LearnedTemplate(generalized)
+        self._templates.move_to_end(key)
+        while len(self._templates) > self.max_templates:
+            self._templates.popitem(last=False)
+    
+    def fill(self, user_input: str, command: Command) -> Optional[Dict[str, Any]]:
+        abstraction = self._abstract(user_input, command)
+        learned = None
+        if abstraction is not None:
+            learned = self._templates.get((command.key, abstraction[0]))
+        if learned is None or learned.observations < self.min_observations:
+            self.misses += 1
+            return None
+        self._templates.move_to_end((command.key, abstraction[0]))
+        self.hits += 1
+        return self._instantiate(learned.result, abstraction[1], user_input)
+    
+    def clear(self):
+        self._templates.clear()
+        self._entities.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "templates": len(self._templates),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0
+        }
+
+class AIParser:
+    """Interface for AI-powered command parsing.
+
+    Concurrent parse_command calls are coalesced: identical requests share
+    one result, and distinct ones are sent to the backend in batches of up
+    to max_batch_size, waiting at most max_wait_ms for a batch to fill.
+    Requests whose callers have all been cancelled are dropped unsent.
+    Utterances matching a template learned from earlier parses are filled
+    locally without a backend call.
+    """
+    
+    BACKENDS = {"local": LocalParserBackend}
+    
+    def __init__(self, backend: Union[str, ParserBackend] = "local", max_batch_size: int = 8, max_wait_ms: int = 10,
+                 template_cache: Dict[str, Any] = None):
+        if isinstance(backend, ParserBackend):
+            self.backend = backend
+        elif backend in self.BACKENDS:
+            self.backend = self.BACKENDS[backend]()
+        else:
+            raise ValueError(f"Unknown AI parser backend: {backend}")
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        
+        # Results learned per utterance template
+        self.templates = TemplateCache(**(template_cache or {}))
+        
+        # (normalized input, command key) -> request, until its batch returns
+        self._pending: Dict[Tuple[str, str], PendingParse] = {}
+        self._queue: List[Tuple[str, str]] = []
+        self._wake = asyncio.Event()
+        self._batcher: Optional[asyncio.Task] = None
+        self._sends: Set[asyncio.Task] = set()
+        self._stats = {"requests": 0, "coalesced": 0, "dropped": 0, "batches": 0, "batched_requests": 0}
+    
+    async def parse_command(self, user_input: str, command: Command, learn: bool = True) -> Dict[str, Any]:
+        """Parse natural language command into structured parameters.
+
+        With learn=False (speculative parses of partial transcripts) the
+        result is not learned as a template, unless a caller that wants it
+        learned shares the same request.
+        """
+        self._stats["requests"] += 1
+        filled = self.templates.fill(user_input, command)
+        if filled is not None:
+            return filled
+        
+        key = (" ".join(user_input.lower().split()), command.key)
+        pending = self._pending.get(key)
+        if pending is None:
+            future = asyncio.get_running_loop().create_future()
+            # Nobody may be left waiting when a backend error arrives
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            pending = self._pending[key] = PendingParse(user_input, command, future)
+            self._queue.append(key)
+            self._wake.set()
+            if self._batcher is None or self._batcher.done():
+                self._batcher = asyncio.create_task(self._run_batches())
+        else:
+            self._stats["coalesced"] += 1
+        
+        pending.learn = pending.learn or learn
+        pending.waiters += 1
+        try:
+            # Shielded so one cancelled caller does not cancel the shared request
+            result = await asyncio.shield(pending.future)
+        finally:
+            pending.waiters -= 1
+        return copy.deepcopy(result)
+    
+    async def _run_batches(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wake.wait()
+            
+            # Let concurrent requests join the batch for up to max_wait_ms
+            deadline = loop.time() + self.max_wait_ms / 1000
+            while len(self._queue) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+            
+            keys, self._queue = self._queue[:self.max_batch_size], self._queue[self.max_batch_size:]
+            if not self._queue:
+                self._wake.clear()
+            
+            batch = []
+            for key in keys:
+                pending = self._pending[key]
+                if pending.waiters == 0:
+                    del self._pending[key]
+                    pending.future.cancel()
+                    self._stats["dropped"] += 1
+                else:
+                    batch.append((key, pending))
+            if batch:
+                # Later batches do not wait for this one to come back
+                send = asyncio.create_task(self._send(batch))
+                self._sends.add(send)
+                send.add_done_callback(self._sends.discard)
+    
+    async def _send(self, batch: List[Tuple[Tuple[str, str], PendingParse]]):
+        self._stats["batches"] += 1
+        self._stats["batched_requests"] += len(batch)
+        try:
+            results = await self.backend.parse_batch([(pending.user_input, pending.command) for _, pending in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"Parser backend returned {len(results)} results for {len(batch)} requests")
+        except Exception as e:
+            logger.error(f"AI parser batch of {len(batch)} failed: {e}")
+            for _, pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+        else:
+            for (_, pending), result in zip(batch, results):
+                if pending.learn:
+                    self.templates.learn(pending.user_input, pending.command, result)
+                if not pending.future.done():
+                    pending.future.set_result(result)
+        finally:
+            for key, _ in batch:
+                self._pending.pop(key, None)
     
     async def clarify_command(self, user_input: str, possible_commands: List[Command]) -> str:
         """Generate clarification question for ambiguous commands"""
@@ -397,52 +2301,217 @@ class AIParser:
             cmd_names = [cmd.name for cmd in possible_commands]
             return f"I found multiple possible commands: {', '.join(cmd_names)}. Which one did you mean?"
         return "I'm not sure what you mean. Could you be more specific?"
+    
+    def get_stats(self) -> Dict[str, Any]:
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "average_batch_size": self._stats["batched_requests"] / batches if batches > 0 else 0,
+            "template_cache": self.templates.get_stats()
+        }
+    
+    async def close(self):
+        """Stop batching and release the backend"""
+        if self._batcher is not None:
+            self._batcher.cancel()
+            await asyncio.gather(self._batcher, return_exceptions=True)
+            self._batcher = None
+        await asyncio.gather(*self._sends, return_exceptions=True)
+        await self.backend.close()
+
+@dataclass
+class DispatchDecision:
+    command_key: str
+    confidence: float
+    parsed_args: Optional[Dict[str, Any]] = None
+
+class DecisionCache:
+    """LRU of recent dispatch decisions, so repeated utterances skip matching and parsing.
+
+    Entries are keyed on the mode, the registry version and the normalized
+    utterance. Reloading the registry changes its version, and invalidate()
+    starts a new generation. Callers read generation before computing a
+    decision and pass it to put(), which discards decisions computed across
+    an invalidation, so stale decisions are never returned.
+    """
+    
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._generation = 0
+        self._entries: "OrderedDict[Tuple[int, str, int, str], DispatchDecision]" = OrderedDict()
+    
+    @property
+    def generation(self) -> int:
+        return self._generation
+    
+    @staticmethod
+    def normalize(utterance: str) -> str:
+        return " ".join(utterance.lower().split())
+    
+    def get(self, mode: AssistantMode, registry_version: int, utterance: str) -> Optional[DispatchDecision]:
+        key = (self._generation, mode.value, registry_version, utterance)
+        decision = self._entries.get(key)
+        if decision is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        # Callers get their own copy of the parsed args to modify
+        return replace(decision, parsed_args=copy.deepcopy(decision.parsed_args))
+    
+    def put(self, mode: AssistantMode, registry_version: int, utterance: str, decision: DispatchDecision,
+            generation: int):
+        if generation != self._generation:
+            # Invalidated while the decision was being computed
+            return
+        key = (generation, mode.value, registry_version, utterance)
+        self._entries[key] = replace(decision, parsed_args=copy.deepcopy(decision.parsed_args))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def contains(self, mode: AssistantMode, registry_version: int, utterance: str) -> bool:
+        """Whether a decision is cached, without counting a lookup"""
+        return (self._generation, mode.value, registry_version, utterance) in self._entries
+    
+    def invalidate(self):
+        """Forget every decision, including any being computed right now"""
+        self._generation += 1
+        self._entries.clear()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0
+        }
 
 class VoiceAssistantDispatcher:
     def __init__(self, config_dir: str = "config"):
         self.config_dir = config_dir
-        self.state_manager = StateManager()
+        self.settings = self._load_settings()
+        self.state_manager = StateManager(**self.settings.get("state", {}))
         self.command_registry = CommandRegistry(os.path.join(config_dir, "commands.yaml"))
-        self.execution_engine = ExecutionEngine()
-        self.ai_parser = AIParser()
+        
+        # Running usage counters, kept by the state manager alongside the history
+        self.state_manager.track("stats", self._apply_stats, self._seed_stats)
+        
+        self.execution_engine = ExecutionEngine(**self.settings.get("execution", {}))
+        self.ai_parser = AIParser(**self.settings.get("ai_parser", {}))
+        
+        # Recent utterance -> command decisions, per mode and registry version
+        self.decision_cache = DecisionCache(**self.settings.get("decision_cache", {}))
+        
+        # Background parses started by speculate(): (mode, registry version, utterance, command key) -> task
+        self._speculations: Dict[Tuple[str, int, str, str], asyncio.Task] = {}
+        self.speculation_top_k = self.settings.get("speculation", {}).get("top_k", 2)
+        self._speculation_stats = {"started": 0, "used": 0, "cancelled": 0}
+        
+        # Dispatch tasks currently executing a command, for cancel_inflight
+        self._inflight: Set[asyncio.Task] = set()
+        
+        # Active (mode, matcher) pair, swapped as a single assignment
+        mode = AssistantMode(self.state_manager.get("current_mode", AssistantMode.GENERAL.value))
+        self._active: Tuple[AssistantMode, ModeMatcher] = (mode, self.command_registry.matchers[mode])
         
         # Ensure config directory exists
         os.makedirs(config_dir, exist_ok=True)
         os.makedirs("logs", exist_ok=True)
         os.makedirs("scripts", exist_ok=True)
     
+    def _load_settings(self) -> Dict[str, Any]:
+        settings_file = os.path.join(self.config_dir, "settings.yaml")
+        try:
+            with open(settings_file, 'r') as f:
+                return yaml.safe_load(f) or {}
+        except FileNotFoundError:
+            logger.info(f"Settings file {settings_file} not found. Using defaults.")
+            return {}
+    
+    async def shutdown(self):
+        """Stop worker processes and persist any buffered state before the assistant exits"""
+        self._cancel_speculations(lambda key: True)
+        await self.ai_parser.close()
+        await self.execution_engine.shutdown()
+        self.state_manager.close()
+    
     @property
     def current_mode(self) -> AssistantMode:
-        return AssistantMode(self.state_manager.get("current_mode", AssistantMode.GENERAL.value))
+        return self._active[0]
     
     def set_mode(self, mode: AssistantMode):
+        self._active = (mode, self.command_registry.matchers[mode])
         self.state_manager.set("current_mode", mode.value)
         logger.info(f"Switched to {mode.value} mode")
     
-    async def dispatch(self, user_input: str) -> CommandResult:
-        """Main dispatch method for processing voice commands"""
-        logger.info(f"Processing command: '{user_input}' in {self.current_mode.value} mode")
-        
-        # Find matching commands
-        matches = self.command_registry.find_matches(user_input, self.current_mode)
-        
-        if not matches:
-            return CommandResult(False, "No matching commands found", 
-                               "Try saying 'help' or be more specific about what you want to do.")
-        
-        # If multiple matches with similar scores, ask for clarification
-        if len(matches) > 1 and abs(matches[0][1] - matches[1][1]) < 0.3:
-            clarification = await self.ai_parser.clarify_command(user_input, [m[0] for m in matches[:3]])
-            return CommandResult(False, clarification, "Command needs clarification")
-        
-        # Use the best match
-        command, confidence = matches[0]
-        logger.info(f"Selected command: {command.key} (confidence: {confidence:.2f})")
+    def reload_commands(self):
+        """Reload the command registry and swap in the rebuilt matcher for the current mode"""
+        self.command_registry.reload()
+        # Cached results and decisions may come from commands that changed or no longer exist
+        self.execution_engine.invalidate_cache()
+        self.decision_cache.invalidate()
+        self.ai_parser.templates.clear()
+        mode = self._active[0]
+        self._active = (mode, self.command_registry.matchers[mode])
+        logger.info(f"Reloaded {len(self.command_registry.commands)} commands")
+    
+    async def dispatch(self, user_input: str,
+                       on_output: Optional[Callable[[OutputChunk], Awaitable[None]]] = None) -> CommandResult:
+        """Main dispatch method for processing voice commands.
+
+        on_output receives the command's output as it is produced.
+        """
+        mode, matcher = self._active
+        logger.info(f"Processing command: '{user_input}' in {mode.value} mode")
         
-        # Parse command if AI parsing is enabled
-        parsed_args = None
-        if command.ai_parsing:
-            parsed_args = await self.ai_parser.parse_command(user_input, command)
+        utterance = DecisionCache.normalize(user_input)
+        registry_version = self.command_registry.version
+        generation = self.decision_cache.generation
+        scope = (mode.value, registry_version, utterance)
+        # Speculations on partials that did not become this utterance are no longer useful
+        self._cancel_speculations(lambda key: key[:3] != scope)
+        try:
+            decision = self.decision_cache.get(mode, registry_version, utterance)
+            if decision is not None:
+                command = self.command_registry.commands[decision.command_key]
+                confidence, parsed_args = decision.confidence, decision.parsed_args
+                logger.info(f"Selected command: {command.key} (confidence: {confidence:.2f}, cached)")
+            else:
+                # Find matching commands
+                matches = matcher.match(utterance)
+            
+                if not matches:
+                    return CommandResult(False, "No matching commands found", 
+                                       "Try saying 'help' or be more specific about what you want to do.")
+            
+                # If multiple matches with similar scores, ask for clarification
+                if len(matches) > 1 and abs(matches[0][1] - matches[1][1]) < 0.3:
+                    clarification = await self.ai_parser.clarify_command(user_input, [m[0] for m in matches[:3]])
+                    return CommandResult(False, clarification, "Command needs clarification")
+            
+                # Use the best match
+                command, confidence = matches[0]
+                logger.info(f"Selected command: {command.key} (confidence: {confidence:.2f})")
+            
+                # Fill arguments from the command's patterns, using AI parsing (if enabled) when none match
+                parsed_args = self.command_registry.rule_parser.parse(user_input, command)
+                if parsed_args is None and command.ai_parsing:
+                    parsed_args = await self._take_speculation(mode, registry_version, utterance, command)
+                    if parsed_args is not None:
+                        # Speculative parses are not learned until they turn out to be final
+                        self.ai_parser.templates.learn(user_input, command, parsed_args)
+                if parsed_args is None and command.ai_parsing:
+                    parsed_args = await self.ai_parser.parse_command(user_input, command)
+            
+                self.decision_cache.put(mode, registry_version, utterance,
+                                        DispatchDecision(command.key, confidence, parsed_args), generation)
+        finally:
+            # Neither are those on this utterance that were not claimed for the chosen command
+            self._cancel_speculations(lambda key: key[:3] == scope)
         
         # Request confirmation if required
         if command.requires_confirmation:
@@ -451,9 +2520,19 @@ class VoiceAssistantDispatcher:
             # For now, we'll proceed, but this is where you'd implement confirmation logic
         
         # Execute the command
-        result = await self.execution_engine.execute_command(command, parsed_args)
+        task = asyncio.current_task()
+        self._inflight.add(task)
+        try:
+            result = await self.execution_engine.execute_command(command, parsed_args, on_output)
+        except asyncio.CancelledError:
+            logger.info(f"Command {command.key} was cancelled")
+            cancelled = CommandResult(False, "", "Command cancelled", metadata={"cancelled": True})
+            self.state_manager.add_to_history(command.key, user_input, cancelled)
+            raise
+        finally:
+            self._inflight.discard(task)
         
-        # Log the command execution
+        # Log the command execution; this also updates the usage counters
         self.state_manager.add_to_history(command.key, user_input, result)
         
         # Log execution details
@@ -464,34 +2543,142 @@ class VoiceAssistantDispatcher:
         
         return result
     
+    def speculate(self, partial_text: str) -> int:
+        """Start AI parsing a partial transcript for its top candidate commands.
+
+        Call this as transcription progresses. If the final utterance is the
+        same, dispatch() uses the finished parse for the command it picks
+        and cancels the others, so parsing overlaps with listening. Starting
+        speculations for a new partial cancels those of earlier ones, and
+        dispatch() cancels whatever is left. Speculative parses are learned
+        as templates only once dispatch() claims them.
+        Returns how many parses were started.
+        """
+        mode, matcher = self._active
+        registry_version = self.command_registry.version
+        utterance = DecisionCache.normalize(partial_text)
+        scope = (mode.value, registry_version, utterance)
+        self._cancel_speculations(lambda key: key[:3] != scope)
+        if not utterance or self.decision_cache.contains(mode, registry_version, utterance):
+            return 0
+        
+        started = 0
+        for command, _ in matcher.match(utterance)[:self.speculation_top_k]:
+            key = scope + (command.key,)
+            if key in self._speculations or not command.ai_parsing:
+                continue
+            if self.command_registry.rule_parser.parse(partial_text, command) is not None:
+                continue
+            self._speculations[key] = asyncio.create_task(
+                self.ai_parser.parse_command(partial_text, command, learn=False))
+            started += 1
+        self._speculation_stats["started"] += started
+        return started
+    
+    def _cancel_speculations(self, predicate: Callable[[Tuple[str, int, str, str]], bool]):
+        for key in [key for key in self._speculations if predicate(key)]:
+            task = self._speculations.pop(key)
+            if not task.done():
+                task.cancel()
+                self._speculation_stats["cancelled"] += 1
+    
+    async def _take_speculation(self, mode: AssistantMode, registry_version: int, utterance: str,
+                                command: Command) -> Optional[Dict[str, Any]]:
+        """Claim the speculative parse for the chosen command, cancelling the losing candidates"""
+        scope = (mode.value, registry_version, utterance)
+        task = self._speculations.pop(scope + (command.key,), None)
+        self._cancel_speculations(lambda key: key[:3] == scope)
+        if task is None:
+            return None
+        
+        try:
+            # Shielded so that task.cancelled() tells a superseded speculation
+            # apart from this dispatch being cancelled
+            parsed_args = await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                task.cancel()
+                raise
+            return None
+        except Exception as e:
+            logger.warning(f"Speculative parse for {command.key} failed: {e}")
+            return None
+        self._speculation_stats["used"] += 1
+        return parsed_args
+    
+    def cancel_inflight(self) -> int:
+        """Cancel every dispatch that is still executing a command, returning how many were cancelled"""
+        current = asyncio.current_task()
+        tasks = [task for task in self._inflight if task is not current and not task.done()]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+    
     def get_available_commands(self, mode: AssistantMode = None) -> List[Command]:
         """Get list of available commands for current or specified mode"""
         if mode is None:
             mode = self.current_mode
             
-        return [cmd for cmd in self.command_registry.commands.values() 
-                if not cmd.modes or mode in cmd.modes]
+        return list(self.command_registry.matchers[mode].commands)
     
-    def get_command_history(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get recent command history"""
-        return self.state_manager.get("last_commands", [])[-limit:]
+    def get_command_history(self, limit: int = 10, command: Optional[str] = None,
+                            success: Optional[bool] = None, since: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get recent command history, optionally filtered by command, outcome or start time"""
+        return self.state_manager.query_history(limit, command, success, since)
     
     def add_alias(self, alias: str, command_key: str):
         """Add a command alias"""
         aliases = self.state_manager.get("aliases", {})
         aliases[alias] = command_key
         self.state_manager.set("aliases", aliases)
+        # Utterances may resolve differently once the alias exists
+        self.decision_cache.invalidate()
+    
+    def _seed_stats(self, history: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Start the running counters from whatever history an older state file kept"""
+        stats = {"total": 0, "success": 0, "failure": 0, "execution_time": 0.0, "commands": {}, "categories": {}}
+        for entry in history:
+            self._apply_stats(stats, entry)
+        return stats
+    
+    def _apply_stats(self, stats: Dict[str, Any], entry: Dict[str, Any]):
+        """Update the running counters for one history entry"""
+        outcome = "success" if entry.get("success") else "failure"
+        execution_time = entry.get("execution_time") or 0.0
+        stats["total"] += 1
+        stats[outcome] += 1
+        stats["execution_time"] += execution_time
+        
+        counters = stats["commands"].setdefault(
+            entry["command"], {"count": 0, "success": 0, "failure": 0, "execution_time": 0.0})
+        counters["count"] += 1
+        counters[outcome] += 1
+        counters["execution_time"] += execution_time
+        
+        command = self.command_registry.commands.get(entry["command"])
+        if command is not None:
+            category = stats["categories"].setdefault(command.category.value, {"count": 0, "execution_time": 0.0})
+            category["count"] += 1
+            category["execution_time"] += execution_time
     
     def get_stats(self) -> Dict[str, Any]:
         """Get usage statistics"""
-        history = self.state_manager.get("last_commands", [])
-        total_commands = len(history)
-        successful_commands = sum(1 for cmd in history if cmd.get("success", False))
+        stats = self.state_manager.get("stats")
+        total_commands = stats["total"]
+        successful_commands = stats["success"]
         
         return {
             "total_commands": total_commands,
             "successful_commands": successful_commands,
+            "failed_commands": stats["failure"],
             "success_rate": successful_commands / total_commands if total_commands > 0 else 0,
+            "average_execution_time": stats["execution_time"] / total_commands if total_commands > 0 else 0,
+            "commands": stats["commands"],
+            "categories": stats["categories"],
+            "result_cache": self.execution_engine.result_cache.get_stats(),
+            "decision_cache": self.decision_cache.get_stats(),
+            "speculation": dict(self._speculation_stats),
+            "ai_parser": self.ai_parser.get_stats(),
             "current_mode": self.current_mode.value,
             "session_start": self.state_manager.get("session_start")
         }
@@ -520,6 +2707,8 @@ async def main():
     # Print stats
     stats = dispatcher.get_stats()
     print(f"\nSession Stats: {stats}")
+    
+    await dispatcher.shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
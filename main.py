@@ -7,7 +7,9 @@ Place this file at: main.py (root level)
 
 import asyncio
 import logging
+import threading
 from dispatcher import VoiceAssistantDispatcher, AssistantMode
+from audio_pipeline import StreamingTranscriber, VoiceActivityDetector, MicrophoneStream, missing_voice_dependencies
 
 # Configure logging
 logging.basicConfig(
@@ -24,60 +26,123 @@ logger = logging.getLogger(__name__)
 class VoiceAssistant:
     def __init__(self):
         self.dispatcher = VoiceAssistantDispatcher()
+        # Whisper is loaded on the first transcription
+        self.transcriber = StreamingTranscriber(**self.dispatcher.settings.get("transcription", {}))
+        self.voice_settings = dict(self.dispatcher.settings.get("voice_input", {}))
+        self.voice_input = False
         self.running = False
+        self._tasks = set()
+        # One Whisper model serves every segment; transcribe them one at a time, in order
+        self._transcription_lock = asyncio.Lock()
         
     async def initialize(self):
         """Initialize the voice assistant"""
         logger.info("Initializing Voice Assistant...")
         
-        # TODO: Initialize voice input (Whisper)
+        # Voice input needs a microphone and Whisper; fall back to typed input without them
+        if self.voice_settings.get("enabled", False):
+            missing = missing_voice_dependencies()
+            if missing:
+                logger.warning(f"Voice input disabled, missing: {', '.join(missing)}. Using text input.")
+            else:
+                self.voice_input = True
+        
         # TODO: Initialize text-to-speech
         # TODO: Initialize any other required services
         
         logger.info(f"Assistant ready in {self.dispatcher.current_mode.value} mode")
         self.running = True
     
+    async def shutdown(self):
+        """Release dispatcher resources and persist buffered state"""
+        self.running = False
+        await self.dispatcher.shutdown()
+    
     async def process_voice_input(self, audio_data):
         """
         Process voice input through the pipeline:
         Audio → Whisper → Dispatcher → TTS Response
         """
         try:
-            # TODO: Transcribe audio using Whisper
-            # For now, we'll simulate this step
             transcribed_text = await self.transcribe_audio(audio_data)
+            await self.respond_to_transcript(transcribed_text)
             
-            if not transcribed_text:
-                return await self.speak("I didn't catch that. Could you repeat?")
-            
-            logger.info(f"Transcribed: '{transcribed_text}'")
-            
-            # Process through dispatcher
-            result = await self.dispatcher.dispatch(transcribed_text)
-            
-            # Generate response
-            if result.success:
-                response = f"Done. {result.output}" if result.output else "Done."
-            else:
-                response = result.output or "Sorry, I couldn't complete that command."
-                if result.error:
-                    logger.error(f"Command error: {result.error}")
-            
-            # Speak the response
-            await self.speak(response)
+        except asyncio.CancelledError:
+            logger.info("Voice command cancelled")
+            await self.speak("Cancelled.")
+            raise
+        except Exception as e:
+            logger.error(f"Error processing voice input: {e}")
+            await self.speak("Sorry, something went wrong.")
+    
+    async def process_audio_stream(self, chunks):
+        """
+        Process voice input while it is being spoken:
+        Audio chunks → streaming Whisper → Dispatcher → TTS Response
+        Stable partial transcripts are handed to the dispatcher to match and
+        parse ahead of time, so the final transcript can act right away.
+        Segments are transcribed one at a time; the frames of a segment that
+        waits its turn queue up in the VAD's bounded stream.
+        """
+        try:
+            transcribed_text = ""
+            stable = ""
+            async with self._transcription_lock:
+                async for hypothesis in self.transcriber.transcribe_stream(chunks):
+                    if hypothesis.final:
+                        transcribed_text = hypothesis.text
+                    elif hypothesis.stable and hypothesis.stable != stable:
+                        stable = hypothesis.stable
+                        logger.debug(f"Stable partial: '{stable}'")
+                        self.dispatcher.speculate(stable)
+            await self.respond_to_transcript(transcribed_text)
             
+        except asyncio.CancelledError:
+            logger.info("Voice command cancelled")
+            await self.speak("Cancelled.")
+            raise
         except Exception as e:
             logger.error(f"Error processing voice input: {e}")
             await self.speak("Sorry, something went wrong.")
     
+    async def respond_to_transcript(self, transcribed_text: str):
+        """Dispatch a transcribed utterance and speak the outcome"""
+        if not transcribed_text:
+            return await self.speak("I didn't catch that. Could you repeat?")
+        
+        logger.info(f"Transcribed: '{transcribed_text}'")
+        
+        if transcribed_text.lower().strip(" .!") == "cancel":
+            return await self.cancel_commands()
+        
+        # Speak the first output while the command keeps running
+        spoken = False
+        
+        async def speak_first_output(chunk):
+            nonlocal spoken
+            if not spoken and chunk.stream == "stdout" and chunk.text.strip():
+                spoken = True
+                await self.speak(chunk.text.strip().splitlines()[0])
+        
+        # Process through dispatcher
+        result = await self.dispatcher.dispatch(transcribed_text, on_output=speak_first_output)
+        
+        # Generate response
+        if result.success:
+            response = f"Done. {result.output}" if result.output and not spoken else "Done."
+        else:
+            response = result.output or "Sorry, I couldn't complete that command."
+            if result.error:
+                logger.error(f"Command error: {result.error}")
+        
+        # Speak the response
+        await self.speak(response)
+    
     async def transcribe_audio(self, audio_data):
         """
-        Transcribe audio using Whisper
-        TODO: Implement actual Whisper integration
+        Transcribe a complete utterance (16 kHz mono 16-bit PCM) using Whisper
         """
-        # Placeholder - replace with actual Whisper implementation
-        # This could be local Whisper or OpenAI API
-        pass
+        return await self.transcriber.transcribe(audio_data)
     
     async def speak(self, text: str):
         """
@@ -102,22 +167,83 @@ class VoiceAssistant:
         print("Voice Assistant is listening... (Press Ctrl+C to stop)")
         
         try:
-            while self.running:
-                # TODO: Implement actual audio capture and voice activity detection
-                # For testing, we'll use text input
-                user_input = input("\n🎤 Say something (or 'quit' to exit): ")
-                
-                if user_input.lower() in ['quit', 'exit', 'stop']:
-                    break
-                
-                if user_input.strip():
-                    # Simulate audio processing
-                    await self.process_text_input(user_input)
+            if self.voice_input:
+                await self.listen_to_microphone()
+            else:
+                await self.listen_to_keyboard()
                 
         except KeyboardInterrupt:
             logger.info("Stopping voice assistant...")
         finally:
             self.running = False
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            # Let cancelled commands wind down before the dispatcher shuts down
+            await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def listen_to_microphone(self):
+        """Transcribe only the voiced segments of the microphone stream, while they are spoken"""
+        vad = VoiceActivityDetector(frame_ms=self.voice_settings.get("frame_ms", 30),
+                                    **self.voice_settings.get("vad", {}))
+        microphone = MicrophoneStream(frame_ms=vad.frame_ms, device_index=self.voice_settings.get("device_index"))
+        
+        async for segment in vad.segment_streams(microphone.frames()):
+            if not self.running:
+                break
+            # Run in the background so capture continues and a spoken "cancel" can interrupt the command;
+            # transcription itself takes one segment at a time
+            self._track(asyncio.create_task(self.process_audio_stream(segment)))
+    
+    async def listen_to_keyboard(self):
+        """Typed input stands in for speech when voice input is off"""
+        while self.running:
+            user_input = await self.read_input("\n🎤 Say something (or 'quit' to exit): ")
+            
+            if user_input.lower() in ['quit', 'exit', 'stop']:
+                break
+            
+            if not user_input.strip():
+                continue
+            # Local commands run inline, so a mode switch applies to every command typed after it
+            if await self.handle_local_command(user_input):
+                continue
+            # Simulate audio processing; run in the background so "cancel" can interrupt it
+            self._track(asyncio.create_task(self.process_text_input(user_input)))
+    
+    def _track(self, task: asyncio.Task):
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def read_input(self, prompt: str) -> str:
+        """Read a line from stdin on a daemon thread so the event loop keeps running"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        
+        def read():
+            try:
+                line = input(prompt)
+            except EOFError:
+                line = "quit"
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(line))
+        
+        threading.Thread(target=read, daemon=True).start()
+        return await future
+    
+    async def cancel_commands(self):
+        """Cancel every command that is still running.
+
+        One-shot processes are terminated and pooled Python workers replaced,
+        and JVM host code is interrupted. Work already running in the Node.js
+        host or in an in-process thread (or JVM code ignoring interrupts)
+        cannot be stopped and finishes in the background; the same holds
+        when a command times out.
+        """
+        cancelled = self.dispatcher.cancel_inflight()
+        if cancelled:
+            await self.speak(f"Cancelled {cancelled} running command{'s' if cancelled != 1 else ''}.")
+        else:
+            await self.speak("Nothing to cancel.")
     
     async def process_text_input(self, text: str):
         """
@@ -126,36 +252,53 @@ class VoiceAssistant:
         try:
             logger.info(f"Processing: '{text}'")
             
-            # Special commands
-            if text.lower().startswith("switch to ") and "mode" in text.lower():
-                await self.handle_mode_switch(text)
+            if await self.handle_local_command(text):
                 return
             
-            if text.lower() in ["help", "what can you do"]:
-                await self.show_help()
-                return
+            streamed = False
             
-            if text.lower() == "status":
-                await self.show_status()
-                return
+            async def print_output(chunk):
+                nonlocal streamed
+                streamed = True
+                print(chunk.text, end="", flush=True)
             
-            # Process through dispatcher
-            result = await self.dispatcher.dispatch(text)
+            # Process through dispatcher, printing output as it arrives
+            result = await self.dispatcher.dispatch(text, on_output=print_output)
+            if streamed:
+                print()
             
             # Generate response
             if result.success:
-                response = f"✅ {result.output}" if result.output else "✅ Done."
+                response = f"✅ {result.output}" if result.output and not streamed else "✅ Done."
             else:
-                response = f"❌ {result.output or 'Command failed.'}"
+                response = f"❌ {(not streamed and result.output) or 'Command failed.'}"
                 if result.error:
                     print(f"   Error details: {result.error}")
             
             print(f"🔊 {response}")
             
+        except asyncio.CancelledError:
+            logger.info(f"Cancelled: '{text}'")
+            print("🔊 Cancelled.")
+            raise
         except Exception as e:
             logger.error(f"Error processing text input: {e}")
             print(f"❌ Sorry, something went wrong: {e}")
     
+    async def handle_local_command(self, text: str) -> bool:
+        """Handle the commands the assistant answers itself, returning whether text was one"""
+        if text.lower().startswith("switch to ") and "mode" in text.lower():
+            await self.handle_mode_switch(text)
+        elif text.lower() in ["help", "what can you do"]:
+            await self.show_help()
+        elif text.lower() == "status":
+            await self.show_status()
+        elif text.lower() == "cancel":
+            await self.cancel_commands()
+        else:
+            return False
+        return True
+    
     async def handle_mode_switch(self, text: str):
         """Handle mode switching commands"""
         text_lower = text.lower()
@@ -228,6 +371,7 @@ async def main():
     except Exception as e:
         logger.error(f"Fatal error: {e}")
     finally:
+        await assistant.shutdown()
         print("Voice Assistant stopped.")
 
 if __name__ == "__main__":
@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+COMMANDS_YAML = """
+commands:
+  - key: echo
+    name: Echo
+    description: Print a greeting
+    keywords: ["hello", "greet"]
+    category: utility
+    environment: system
+    script_path: echo hello
+    modes: ["general"]
+"""
+
+@pytest.fixture
+def assistant_dir(tmp_path, monkeypatch):
+    """A working directory with a minimal command registry and default settings"""
+    config_dir = tmp_path / "config"
+    config_dir.mkdir()
+    (config_dir / "commands.yaml").write_text(COMMANDS_YAML)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
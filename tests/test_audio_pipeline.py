@@ -0,0 +1,163 @@
+import asyncio
+
+from audio_pipeline import SAMPLE_RATE, SAMPLE_WIDTH, StreamingTranscriber, VoiceActivityDetector
+
+VOICED = b"\x01\x00"
+SILENT = b"\x00\x00"
+
+
+def make_vad():
+    vad = VoiceActivityDetector(frame_ms=10, start_ms=20, hangover_ms=30, preroll_ms=20, min_speech_ms=50)
+    # Frames of nonzero samples count as speech, so the test does not depend on numpy
+    vad.is_speech = lambda frame: frame[0] != 0
+    return vad
+
+
+def frames(pattern):
+    vad = make_vad()
+    return [(VOICED if voiced == "v" else SILENT) * (vad.frame_bytes // 2) for voiced in pattern]
+
+
+async def feed(chunks):
+    for chunk in chunks:
+        await asyncio.sleep(0)
+        yield chunk
+
+
+def test_segment_streams_match_segments():
+    # A short blip that is dropped, then two segments of real speech
+    audio = frames("ssvvsss" + "ssvvvvvvvsss" + "svvvvvvvvvv")
+
+    async def collect_segments():
+        return [segment async for segment in make_vad().segments(feed(audio))]
+
+    async def collect_streams():
+        streamed = []
+        async for stream in make_vad().segment_streams(feed(audio)):
+            streamed.append(asyncio.create_task(consume(stream)))
+        return [await task for task in streamed]
+
+    async def consume(stream):
+        return b"".join([frame async for frame in stream])
+
+    segments = asyncio.run(collect_segments())
+    assert len(segments) == 2
+    assert asyncio.run(collect_streams()) == segments
+
+
+def test_segment_stream_delivers_frames_before_the_segment_closes():
+    audio = frames("svvvvvvvvvv" + "ssss")
+    vad = make_vad()
+
+    async def first_frame_while_open(stream):
+        async for _ in stream:
+            return vad.in_speech
+
+    async def run():
+        tasks = []
+        async for stream in vad.segment_streams(feed(audio)):
+            tasks.append(asyncio.create_task(first_frame_while_open(stream)))
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(run()) == [True]
+
+
+def test_segment_stream_reading_waits_for_a_slow_consumer():
+    audio = frames("svvvvvvvvvvvvvvvvvvvvvvvv" + "ssss")
+    vad = make_vad()
+    vad.max_queued_frames = 8
+    read = []
+
+    async def source():
+        for chunk in audio:
+            read.append(chunk)
+            await asyncio.sleep(0)
+            yield chunk
+
+    async def run():
+        streams = vad.segment_streams(source())
+        stream = await streams.__anext__()
+        pending = asyncio.create_task(streams.__anext__())
+        for _ in range(50):
+            await asyncio.sleep(0)
+        # Reading stalled with the stream's queue full
+        stalled_at = len(read)
+        consumed = [frame async for frame in stream]
+        pending.cancel()
+        return stalled_at, consumed
+
+    stalled_at, consumed = asyncio.run(run())
+    assert stalled_at < len(audio)
+    assert b"".join(consumed) == b"".join(audio[:-1])
+
+
+def make_transcriber(texts, started=None, release=None):
+    """A transcriber whose model returns texts in turn, recording the seconds of audio each pass saw"""
+    transcriber = StreamingTranscriber(step_ms=100, stability_count=2)
+    transcriber.passes = []
+
+    async def transcribe_pcm(pcm):
+        transcriber.passes.append(len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH))
+        if started is not None:
+            started.set()
+        if release is not None:
+            await release.wait()
+        return texts[len(transcriber.passes) - 1]
+
+    transcriber._transcribe_pcm = transcribe_pcm
+    return transcriber
+
+
+def step(transcriber):
+    return SILENT * (int(transcriber.step_ms * SAMPLE_RATE / 1000) * SAMPLE_WIDTH // 2)
+
+
+def test_streaming_tracks_the_stable_prefix_and_ends_with_a_final_hypothesis():
+    transcriber = make_transcriber(["turn", "turn on the", "Turn on the lights", "turn on the lights."])
+
+    async def chunks():
+        for _ in range(3):
+            passes = len(transcriber.passes)
+            yield step(transcriber)
+            # One pass per step
+            while len(transcriber.passes) == passes:
+                await asyncio.sleep(0)
+
+    async def run():
+        return [hypothesis async for hypothesis in transcriber.transcribe_stream(chunks())]
+
+    hypotheses = asyncio.run(run())
+    assert [(h.text, h.final, h.stable) for h in hypotheses] == [
+        ("turn", False, ""),
+        ("turn on the", False, "turn"),
+        ("Turn on the lights", False, "Turn on the"),
+        ("turn on the lights.", True, "turn on the lights."),
+    ]
+    assert [round(h.audio_seconds, 3) for h in hypotheses] == [0.1, 0.2, 0.3, 0.3]
+
+
+def test_streaming_keeps_reading_during_a_pass_and_skips_stale_steps():
+    started, release = asyncio.Event(), asyncio.Event()
+    transcriber = make_transcriber(["one", "one two three four five", "one two three four five"], started, release)
+
+    async def chunks():
+        yield step(transcriber)
+        await started.wait()
+        # Arrive while the first pass is still running
+        for _ in range(4):
+            yield step(transcriber)
+        release.set()
+        while len(transcriber.passes) < 2:
+            await asyncio.sleep(0)
+
+    async def collect():
+        return [hypothesis async for hypothesis in transcriber.transcribe_stream(chunks())]
+
+    async def run():
+        # Reading blocked behind the pass would never release it
+        return await asyncio.wait_for(collect(), timeout=5)
+
+    hypotheses = asyncio.run(run())
+    # The four steps read during the first pass were covered by a single catch-up pass
+    assert [round(seconds, 3) for seconds in transcriber.passes] == [0.1, 0.5, 0.5]
+    assert [h.final for h in hypotheses] == [False, False, True]
@@ -0,0 +1,632 @@
+import asyncio
+import base64
+import shutil
+import subprocess
+import sys
+import time
+import types
+
+import pytest
+
+from dispatcher import (WORKERS_DIR, AssistantMode, Command, CommandCategory, CommandPriority, CommandRegistry,
+                        CommandResult, ExecutionEngine, ExecutionEnvironment, ExecutionScheduler, InProcessRunner,
+                        JsonStateBackend, JvmHost, KeywordAutomaton, ModeMatcher, NodeHost, PythonWorkerPool,
+                        ResultCache, RuleParser, StageTimings, TemplateCache, VoiceAssistantDispatcher)
+
+requires_javac = pytest.mark.skipif(shutil.which("javac") is None, reason="needs a JDK")
+requires_node = pytest.mark.skipif(shutil.which("node") is None, reason="needs Node.js")
+
+
+def make_command(key="echo", environment=ExecutionEnvironment.SYSTEM, script_path="echo hello", **fields):
+    return Command(key=key, name=key.title(), description=f"{key} command", keywords=fields.pop("keywords", [key]),
+                   category=CommandCategory.UTILITY, environment=environment, script_path=script_path, **fields)
+
+
+def test_dispatches_append_to_journal_without_rewriting_snapshot(assistant_dir, monkeypatch):
+    snapshots = []
+    write_snapshot = JsonStateBackend._write_snapshot
+
+    def counting_write_snapshot(self, state, new_entries):
+        snapshots.append(new_entries)
+        write_snapshot(self, state, new_entries)
+
+    monkeypatch.setattr(JsonStateBackend, "_write_snapshot", counting_write_snapshot)
+
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        # Persist the initial defaults so only the dispatches are measured
+        dispatcher.state_manager.flush()
+        snapshots.clear()
+        for _ in range(10):
+            result = await dispatcher.dispatch("hello")
+            assert result.success
+        journal_lines = (assistant_dir / "state" / "assistant_state_history.jsonl").read_text().splitlines()
+        snapshots_during_dispatch = len(snapshots)
+        await dispatcher.shutdown()
+        return journal_lines, snapshots_during_dispatch
+
+    journal_lines, snapshots_during_dispatch = asyncio.run(run())
+    assert len(journal_lines) == 10
+    assert snapshots_during_dispatch == 0
+
+
+def test_stats_survive_restart(assistant_dir):
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        for _ in range(3):
+            await dispatcher.dispatch("hello")
+        await dispatcher.shutdown()
+        restarted = VoiceAssistantDispatcher()
+        stats = restarted.get_stats()
+        await restarted.shutdown()
+        return stats
+
+    stats = asyncio.run(run())
+    assert stats["total_commands"] == 3
+    assert stats["commands"]["echo"]["count"] == 3
+
+
+def test_stats_agree_with_journaled_history_after_a_crash(assistant_dir):
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        for _ in range(4):
+            await dispatcher.dispatch("hello")
+        # No shutdown: the counters were never snapshotted, only the history journal was written
+        restarted = VoiceAssistantDispatcher()
+        stats = restarted.get_stats()
+        history = restarted.get_command_history(limit=50)
+        await restarted.shutdown()
+        return stats, history
+
+    stats, history = asyncio.run(run())
+    assert len(history) == 4
+    assert stats["total_commands"] == 4
+    assert stats["commands"]["echo"]["count"] == 4
+    assert stats["categories"]["utility"]["count"] == 4
+
+
+def test_get_stats_returns_a_copy(assistant_dir):
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        await dispatcher.dispatch("hello")
+        dispatcher.get_stats()["commands"]["echo"]["count"] = 100
+        stats = dispatcher.get_stats()
+        await dispatcher.shutdown()
+        return stats
+
+    assert asyncio.run(run())["commands"]["echo"]["count"] == 1
+
+
+def test_decision_computed_across_invalidation_is_not_cached(assistant_dir):
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        command = dispatcher.command_registry.commands["echo"]
+        command.ai_parsing = True
+        parse_started = asyncio.Event()
+        release_parse = asyncio.Event()
+
+        async def slow_parse(user_input, cmd):
+            parse_started.set()
+            await release_parse.wait()
+            return {"raw_input": user_input, "command_key": cmd.key}
+
+        dispatcher.ai_parser.parse_command = slow_parse
+        dispatch = asyncio.create_task(dispatcher.dispatch("hello"))
+        await parse_started.wait()
+        dispatcher.add_alias("hi", "echo")
+        release_parse.set()
+        await dispatch
+
+        cached = dispatcher.decision_cache.get(
+            dispatcher.current_mode, dispatcher.command_registry.version, "hello")
+        await dispatcher.shutdown()
+        return cached
+
+    assert asyncio.run(run()) is None
+
+
+def test_cancelling_dispatch_while_awaiting_speculation_propagates(assistant_dir):
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        command = dispatcher.command_registry.commands["echo"]
+        parse_started = asyncio.Event()
+
+        async def slow_parse(user_input, cmd):
+            parse_started.set()
+            await asyncio.Event().wait()
+
+        mode, _ = dispatcher._active
+        version = dispatcher.command_registry.version
+        utterance = "hello"
+        speculation = asyncio.create_task(slow_parse(utterance, command))
+        dispatcher._speculations[(mode.value, version, utterance, command.key)] = speculation
+        await parse_started.wait()
+
+        taking = asyncio.create_task(dispatcher._take_speculation(mode, version, utterance, command))
+        await asyncio.sleep(0)
+        taking.cancel()
+        try:
+            await taking
+            taken_cancelled = False
+        except asyncio.CancelledError:
+            taken_cancelled = True
+        await asyncio.sleep(0)
+        await dispatcher.shutdown()
+        return taken_cancelled, speculation.cancelled()
+
+    taken_cancelled, speculation_cancelled = asyncio.run(run())
+    assert taken_cancelled
+    assert speculation_cancelled
+
+
+def test_superseded_speculation_falls_back_to_parsing(assistant_dir):
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        command = dispatcher.command_registry.commands["echo"]
+        mode, _ = dispatcher._active
+        version = dispatcher.command_registry.version
+        utterance = "hello"
+        speculation = asyncio.create_task(asyncio.Event().wait())
+        dispatcher._speculations[(mode.value, version, utterance, command.key)] = speculation
+
+        taking = asyncio.create_task(dispatcher._take_speculation(mode, version, utterance, command))
+        await asyncio.sleep(0)
+        speculation.cancel()
+        parsed_args = await taking
+        await dispatcher.shutdown()
+        return parsed_args
+
+    assert asyncio.run(run()) is None
+
+
+def test_only_final_dispatches_learn_templates(assistant_dir):
+    async def run():
+        dispatcher = VoiceAssistantDispatcher()
+        dispatcher.command_registry.commands["echo"].ai_parsing = True
+        templates = dispatcher.ai_parser.templates
+
+        # A partial that never becomes final is parsed but not learned
+        assert dispatcher.speculate("hello there 5") == 1
+        await asyncio.gather(*dispatcher._speculations.values())
+        learned_from_partial = templates.get_stats()["templates"]
+        leftover = asyncio.create_task(asyncio.Event().wait())
+        dispatcher._speculations[(dispatcher.current_mode.value, dispatcher.command_registry.version,
+                                  "hello 7", "other")] = leftover
+
+        await dispatcher.dispatch("hello 7")
+        await asyncio.sleep(0)
+        remaining = dict(dispatcher._speculations)
+        await dispatcher.shutdown()
+        return learned_from_partial, templates.get_stats()["templates"], remaining, leftover.cancelled()
+
+    learned_from_partial, learned, remaining, leftover_cancelled = asyncio.run(run())
+    assert learned_from_partial == 0
+    assert learned == 1
+    assert remaining == {}
+    assert leftover_cancelled
+
+
+def test_worker_pool_keeps_its_slot_when_a_restart_fails(tmp_path):
+    script = tmp_path / "hello.py"
+    script.write_text("print('hello')\n")
+
+    async def run():
+        pool = PythonWorkerPool(sys.executable, size=1)
+        await pool.start()
+        pool._workers[0].kill()
+        await pool._workers[0].process.wait()
+        pool.python_path = str(tmp_path / "missing-python")
+        failed = await asyncio.wait_for(pool.run(str(script), []), timeout=5)
+        pool.python_path = sys.executable
+        recovered = await asyncio.wait_for(pool.run(str(script), []), timeout=10)
+        await pool.close()
+        return failed, recovered
+
+    failed, recovered = asyncio.run(run())
+    assert not failed.success
+    assert recovered.success
+    assert recovered.output == "hello"
+
+
+def test_worker_scripts_cannot_read_the_protocol_stream(tmp_path):
+    reader = tmp_path / "reader.py"
+    reader.write_text(
+        "import subprocess, sys\n"
+        "try:\n"
+        "    input()\n"
+        "except EOFError:\n"
+        "    print('eof')\n"
+        "print(repr(sys.stdin.read()))\n"
+        "subprocess.run([sys.executable, '-c', 'import sys; print(repr(sys.stdin.read()))'])\n")
+    hello = tmp_path / "hello.py"
+    hello.write_text("print('hello')\n")
+
+    async def run():
+        pool = PythonWorkerPool(sys.executable, size=1)
+        await pool.start()
+        try:
+            first = await asyncio.wait_for(pool.run(str(reader), []), timeout=10)
+            second = await asyncio.wait_for(pool.run(str(hello), []), timeout=10)
+        finally:
+            await pool.close()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first.output.startswith("eof\n''")
+    assert second.success
+    assert second.output == "hello"
+
+
+def test_in_process_scripts_with_the_same_file_name_load_as_separate_modules(tmp_path):
+    script = """
+import dataclasses
+import pickle
+
+@dataclasses.dataclass
+class Reply:
+    text: str
+
+def run(args):
+    return pickle.loads(pickle.dumps(Reply({name!r}))).text
+"""
+    paths = []
+    for name in ("first", "second"):
+        (tmp_path / name).mkdir()
+        path = tmp_path / name / "tool.py"
+        path.write_text(script.format(name=name))
+        paths.append(str(path))
+
+    async def run():
+        runner = InProcessRunner()
+        return [await runner.run(make_command("tool", ExecutionEnvironment.PYTHON, path, in_process=True), {},
+                                 StageTimings()) for path in paths]
+
+    results = asyncio.run(run())
+    assert [result.output for result in results] == ["first", "second"]
+    assert all(result.success for result in results)
+
+
+@requires_javac
+def test_jvm_host_compiles(tmp_path):
+    compiled = subprocess.run(["javac", "-d", str(tmp_path), f"{WORKERS_DIR}/JvmHost.java"],
+                              capture_output=True, text=True)
+    assert compiled.returncode == 0, compiled.stderr
+
+
+@requires_javac
+def test_jvm_host_runs_classes_only_for_token_holders(tmp_path, monkeypatch):
+    (tmp_path / "Greeter.java").write_text(
+        "public class Greeter {\n"
+        "    public static int hostMain(String[] args) {\n"
+        "        System.out.println(\"hello \" + args[0]);\n"
+        "        return 0;\n"
+        "    }\n"
+        "}\n"
+    )
+    subprocess.run(["javac", "Greeter.java"], cwd=tmp_path, check=True)
+    monkeypatch.chdir(tmp_path)
+
+    async def run():
+        host = JvmHost(shutil.which("java"))
+        try:
+            result = await host.run("Greeter", ["world"])
+            reader, writer = await asyncio.open_connection("127.0.0.1", host.port)
+            target = base64.b64encode(b"Greeter").decode()
+            writer.write(f"not-the-token\t1\t{target}\n".encode())
+            await writer.drain()
+            unauthenticated = await reader.readline()
+            writer.close()
+        finally:
+            await host.close()
+        return result, unauthenticated
+
+    result, unauthenticated = asyncio.run(run())
+    assert result.success, result.error
+    assert result.output == "hello world"
+    assert unauthenticated == b""
+
+
+@requires_node
+def test_node_host_survives_malformed_lines(tmp_path):
+    script = tmp_path / "noisy.js"
+    script.write_text("module.exports = () => { process.stdout.write('not json\\n'); return 'ok'; };\n")
+
+    async def run():
+        host = NodeHost(shutil.which("node"))
+        try:
+            await host.start()
+            host.process.stdin.write(b"{not a request\n5\n")
+            results = [await asyncio.wait_for(host.run(str(script), []), timeout=10) for _ in range(2)]
+            alive = host.alive
+        finally:
+            await host.close()
+        return results, alive
+
+    results, alive = asyncio.run(run())
+    assert [result.output for result in results] == ["ok", "ok"]
+    assert alive
+
+
+@requires_node
+def test_node_host_exit_does_not_fail_requests_sent_to_its_replacement(tmp_path):
+    script = tmp_path / "slow.js"
+    script.write_text("module.exports = () => new Promise(resolve => setTimeout(() => resolve('done'), 200));\n")
+
+    async def run():
+        host = NodeHost(shutil.which("node"))
+        try:
+            await host.start()
+            # An exited predecessor whose reader finishes while the new host is answering
+            old_output = asyncio.StreamReader()
+
+            async def exited():
+                return 1
+
+            old_process = types.SimpleNamespace(stdout=old_output, returncode=1, wait=exited)
+            old_request = asyncio.get_running_loop().create_future()
+            old_reader = asyncio.create_task(host._read_responses(old_process, {1: old_request}))
+            request = asyncio.create_task(host.run(str(script), []))
+            await asyncio.sleep(0.05)
+            old_output.feed_eof()
+            await old_reader
+            result = await asyncio.wait_for(request, timeout=10)
+        finally:
+            await host.close()
+        return result, old_request
+
+    result, old_request = asyncio.run(run())
+    assert result.success, result.error
+    assert result.output == "done"
+    assert isinstance(old_request.exception(), ConnectionError)
+
+
+def test_keyword_automaton_finds_overlapping_keywords():
+    automaton = KeywordAutomaton(["he", "she", "his", "hers", "shell", "she"])
+    text = "ushers sell shells"
+
+    hits = sorted((automaton.keywords[keyword_id], start, end) for keyword_id, start, end in automaton.find_all(text))
+    expected = sorted((keyword, start, start + len(keyword)) for keyword in automaton.keywords
+                      for start in range(len(text)) if text.startswith(keyword, start))
+    assert hits == expected
+    assert {("she", 1, 4), ("he", 2, 4), ("hers", 2, 6), ("shell", 12, 17)} <= set(hits)
+
+
+def test_mode_matcher_scores_like_a_full_keyword_scan():
+    commands = [
+        make_command("open", keywords=["open", "launch", "start"]),
+        make_command("notes", keywords=["note", "open notes"]),
+        make_command("music", keywords=["play", "music"], modes=[AssistantMode.STREAMING]),
+    ]
+    matcher = ModeMatcher(AssistantMode.GENERAL, commands)
+
+    def full_scan(user_input):
+        user_input = user_input.lower()
+        scores = []
+        for command in matcher.commands:
+            score = 0.0
+            for keyword in command.keywords:
+                if keyword in user_input:
+                    score += 1.0 if keyword == user_input else 0.8 if user_input.startswith(keyword) else 0.5
+            if score:
+                scores.append((command.key, round(score, 6)))
+        return sorted(scores, key=lambda item: item[1], reverse=True)
+
+    def matched(user_input):
+        return [(command.key, round(score, 6)) for command, score in matcher.match(user_input)]
+
+    # Commands outside the mode are never candidates
+    assert [command.key for command in matcher.commands] == ["open", "notes"]
+    for user_input in ["open", "Open Notes", "please open notes and start", "take a note", "play music", "nothing"]:
+        assert matched(user_input) == full_scan(user_input)
+    assert matched("open notes") == [("notes", 1.5), ("open", 0.8)]
+    assert matched("launch") == [("open", 1.0)]
+
+
+def test_rule_parser_fills_typed_slots():
+    mixer = make_command("mixer", patterns=[
+        "patch strip {strip:int} to {bus}",
+        "set {target:main|aux one} gain to {gain:float}",
+        "{action:mute|unmute} strip {strip:int}",
+        "label strip {strip:int} as {label:text}",
+        "broken {slot:int?}",
+    ])
+    parser = RuleParser([mixer])
+
+    def parse(user_input):
+        parsed = parser.parse(user_input, mixer)
+        if parsed is not None:
+            assert parsed.pop("raw_input") == user_input
+            assert parsed.pop("command_key") == "mixer"
+        return parsed
+
+    assert parse("patch strip 3 to B1") == {"strip": 3, "bus": "B1"}
+    assert parse("Set AUX  one gain to -2.5.") == {"target": "aux one", "gain": -2.5}
+    assert parse("unmute strip 12") == {"action": "unmute", "strip": 12}
+    assert parse("label strip 2 as lead vocal mic!") == {"strip": 2, "label": "lead vocal mic"}
+    # Slot types reject values that do not fit, leaving the input to the AI parser
+    assert parse("patch strip three to B1") is None
+    assert parse("patch strip 3 to bus B1") is None
+    assert parse("set monitor gain to 4") is None
+    # The pattern with an unknown slot type was skipped
+    assert [template for template, _, _ in parser.patterns["mixer"]] == mixer.patterns[:4]
+    with pytest.raises(ValueError, match="unknown slot type"):
+        RuleParser.compile("broken {slot:int?}")
+    with pytest.raises(ValueError, match="duplicate slot"):
+        RuleParser.compile("{a:int} to {a:int}")
+
+
+def test_scheduler_enforces_global_environment_and_command_limits():
+    async def run():
+        scheduler = ExecutionScheduler(max_concurrency=3, max_queue=1, command_limit=2,
+                                       environment_limits={"python": 1}, reserved_high_slots=0)
+        echo = make_command("echo")
+        other = make_command("other")
+        script = make_command("script", ExecutionEnvironment.PYTHON, "script.py")
+        report = make_command("report", ExecutionEnvironment.PYTHON, "report.py")
+        states = {}
+
+        assert await scheduler.acquire(echo) == 0.0
+        assert await scheduler.acquire(echo) == 0.0
+        # Over the per-command limit while global slots are free
+        third_echo = asyncio.create_task(scheduler.acquire(echo))
+        await asyncio.sleep(0)
+        states["command limit"] = third_echo.done()
+        # The queue is full, so a command that cannot start is turned away
+        assert await scheduler.acquire(script) == 0.0
+        states["overflow"] = await scheduler.acquire(other)
+
+        scheduler.release(echo)
+        await asyncio.sleep(0)
+        states["after release"] = third_echo.done()
+        # Over the python limit; the global limit is reached too
+        waiting_report = asyncio.create_task(scheduler.acquire(report))
+        await asyncio.sleep(0)
+        states["environment limit"] = waiting_report.done()
+        scheduler.release(echo)
+        await asyncio.sleep(0)
+        states["global slot only"] = waiting_report.done()
+        scheduler.release(script)
+        await asyncio.sleep(0)
+        states["environment slot"] = waiting_report.done()
+        states["stats"] = scheduler.get_stats()
+        return states
+
+    states = asyncio.run(run())
+    assert states["command limit"] is False
+    assert states["overflow"] is None
+    assert states["after release"] is True
+    assert states["environment limit"] is False
+    assert states["global slot only"] is False
+    assert states["environment slot"] is True
+    assert states["stats"] == {"running": 2, "queued": 0, "running_by_environment": {"system": 1, "python": 1}}
+
+
+def test_scheduler_reserves_slots_for_high_priority_and_starts_waiters_by_priority():
+    async def run():
+        scheduler = ExecutionScheduler(max_concurrency=2, max_queue=2, command_limit=10, reserved_high_slots=1)
+        normal = make_command("normal")
+        low = make_command("low", priority=CommandPriority.LOW)
+        high = make_command("high", priority=CommandPriority.HIGH)
+        started = []
+
+        async def start(command):
+            await scheduler.acquire(command)
+            started.append(command.key)
+
+        assert await scheduler.acquire(normal) == 0.0
+        # The second slot is reserved: LOW and NORMAL wait, HIGH takes it
+        waiting = [asyncio.create_task(start(low)), asyncio.create_task(start(normal))]
+        await asyncio.sleep(0)
+        assert await scheduler.acquire(high) == 0.0
+        # HIGH may wait even when the queue is full
+        waiting.append(asyncio.create_task(start(high)))
+        await asyncio.sleep(0)
+        queued = scheduler.get_stats()["queued"]
+
+        for command in (high, normal, high, normal):
+            scheduler.release(command)
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiting)
+        return queued, started
+
+    queued, started = asyncio.run(run())
+    assert queued == 3
+    assert started == ["high", "normal", "low"]
+
+
+def test_one_shot_output_is_capped_without_a_consumer(tmp_path):
+    script = tmp_path / "chatty.py"
+    script.write_text("print('x' * 100000)\nprint('tail')\n")
+    command = make_command("chatty", script_path=f"{sys.executable} {script}")
+
+    async def run():
+        engine = ExecutionEngine(max_output_chars=1000, executable_cache=str(tmp_path / "executables.json"))
+        result = await engine.execute_command(command)
+        await engine.shutdown()
+        return result
+
+    result = asyncio.run(run())
+    assert result.success
+    assert len(result.output) <= 1000
+    assert result.output.endswith("tail")
+    assert result.metadata["output_truncated"]
+
+
+def test_result_cache_hits_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    cache = ResultCache(max_entries=2, default_ttl_ms=1000)
+    command = make_command("weather", cacheable={"key": ["city"]})
+
+    paris = cache.make_key(command, {"city": "Paris", "raw_input": "weather in paris"})
+    assert paris == cache.make_key(command, {"city": " paris ", "raw_input": "what's the weather in Paris"})
+    cache.put(paris, CommandResult(True, "sunny"))
+    assert cache.get(paris).output == "sunny"
+    now[0] += 1.5
+    assert cache.get(paris) is None
+
+    first, second, third, fourth = (cache.make_key(command, {"city": city}) for city in "abcd")
+    for key in (first, second, third):
+        cache.put(key, CommandResult(True, key))
+    assert cache.get(first) is None
+    # Reading third makes second the least recently used entry
+    assert cache.get(third).output == third
+    cache.put(fourth, CommandResult(True, fourth))
+    assert cache.get(second) is None
+    assert cache.get(third) is not None
+    assert cache.get_stats()["entries"] == 2
+
+
+def test_cached_results_are_copies_and_default_ttl_applies(tmp_path):
+    command = make_command(cacheable={})
+
+    async def run():
+        engine = ExecutionEngine(executable_cache=str(tmp_path / "executables.json"))
+        first = await engine.execute_command(command)
+        first.output = "changed"
+        first.metadata["changed"] = True
+        second = await engine.execute_command(command)
+        second.metadata["timings"]["run_ms"] = -1
+        third = await engine.execute_command(command)
+        await engine.shutdown()
+        return second, third
+
+    second, third = asyncio.run(run())
+    assert second.output == third.output == "hello"
+    assert second.metadata["cache_hit"] and third.metadata["cache_hit"]
+    assert "changed" not in third.metadata
+    assert third.metadata["timings"]["run_ms"] != -1
+
+
+def test_failed_registry_reload_keeps_the_current_commands(assistant_dir):
+    registry_file = assistant_dir / "config" / "commands.yaml"
+    registry = CommandRegistry(str(registry_file))
+    registry_file.write_text("commands:\n  - key: broken\n    name: Broken\n")
+
+    with pytest.raises(KeyError):
+        registry.reload()
+
+    assert list(registry.commands) == ["echo"]
+    assert registry.version == 0
+    matches = registry.find_matches("hello", AssistantMode.GENERAL)
+    assert [command.key for command, _ in matches] == ["echo"]
+    assert registry.commands[matches[0][0].key] is matches[0][0]
+
+
+def test_template_cache_fills_learned_templates():
+    cache = TemplateCache(min_observations=2)
+    command = make_command("app_launcher", metadata={"common_apps": ["notepad", "chrome", "spotify"]})
+
+    def parse(utterance, app, volume):
+        # "raw_input" as a value must survive filling like any other argument
+        return {"raw_input": utterance, "action": "open", "target": app, "volume": volume, "source": "raw_input"}
+
+    cache.learn("open notepad at volume 20", command, parse("open notepad at volume 20", "notepad", 20))
+    assert cache.fill("open spotify at volume 35", command) is None
+    cache.learn("Open chrome at volume 40.", command, parse("Open chrome at volume 40.", "chrome", 40))
+
+    filled = cache.fill("open spotify at volume 35", command)
+    assert filled == parse("open spotify at volume 35", "spotify", 35)
+    # A different template was never learned
+    assert cache.fill("close spotify", command) is None
+    assert cache.get_stats()["hits"] == 1
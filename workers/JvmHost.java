@@ -0,0 +1,289 @@
+// Resident JVM Host
+// Long-lived JVM used by the ExecutionEngine for in_process JAVA commands,
+// similar in spirit to nailgun: jars and classes are loaded once and stay hot.
+// Place this file at: workers/JvmHost.java (run with `java workers/JvmHost.java`, Java 11+)
+//
+// On startup the host binds a loopback port and prints "PORT <n> <token>" on
+// stdout. The token is random per host and only the ExecutionEngine, which
+// reads our stdout, knows it; connections that do not send it are closed
+// without running anything. Each connection carries one request line and
+// gets one response line back, with every variable field base64 encoded and
+// fields separated by tabs:
+//   request:  <token> \t <id> \t <target> \t <arg> \t <arg> ...
+//   response: <id> \t <exit code> \t <stdout> \t <stderr>
+// <target> is a jar with a Main-Class manifest entry, or a class name on the
+// working directory classpath. Classes may declare `public static int
+// hostMain(String[] args)` to report an exit code; otherwise main(String[])
+// is called and exits with 0 unless it throws. Hosted code must not call
+// System.exit, which would stop the host. Closing the connection before the
+// response arrives interrupts the thread running the request; code that
+// ignores interrupts runs to completion. The host exits when stdin closes.
+
+import java.io.ByteArrayOutputStream;
+import java.io.BufferedReader;
+import java.io.File;
+import java.io.IOException;
+import java.io.InputStreamReader;
+import java.io.OutputStream;
+import java.io.OutputStreamWriter;
+import java.io.PrintStream;
+import java.io.Writer;
+import java.lang.reflect.InvocationTargetException;
+import java.lang.reflect.Method;
+import java.lang.reflect.Modifier;
+import java.net.InetAddress;
+import java.net.ServerSocket;
+import java.net.Socket;
+import java.net.URL;
+import java.net.URLClassLoader;
+import java.nio.charset.StandardCharsets;
+import java.security.MessageDigest;
+import java.security.SecureRandom;
+import java.util.Base64;
+import java.util.Map;
+import java.util.concurrent.ConcurrentHashMap;
+import java.util.concurrent.ExecutorService;
+import java.util.concurrent.Executors;
+import java.util.concurrent.atomic.AtomicBoolean;
+import java.util.jar.Attributes;
+import java.util.jar.JarFile;
+import java.util.jar.Manifest;
+
+public class JvmHost {
+    private static final class Loaded {
+        final long modified;
+        final Class<?> mainClass;
+        final URLClassLoader loader;
+
+        Loaded(long modified, Class<?> mainClass, URLClassLoader loader) {
+            this.modified = modified;
+            this.mainClass = mainClass;
+            this.loader = loader;
+        }
+    }
+
+    /** Sends writes to the calling request's buffer, or to the fallback stream outside requests. */
+    private static final class RoutingOutputStream extends OutputStream {
+        private final OutputStream fallback;
+        private final ThreadLocal<ByteArrayOutputStream> target;
+
+        RoutingOutputStream(OutputStream fallback, ThreadLocal<ByteArrayOutputStream> target) {
+            this.fallback = fallback;
+            this.target = target;
+        }
+
+        @Override
+        public void write(int b) throws IOException {
+            ByteArrayOutputStream buffer = target.get();
+            if (buffer != null) {
+                buffer.write(b);
+            } else {
+                fallback.write(b);
+            }
+        }
+
+        @Override
+        public void write(byte[] b, int off, int len) throws IOException {
+            ByteArrayOutputStream buffer = target.get();
+            if (buffer != null) {
+                buffer.write(b, off, len);
+            } else {
+                fallback.write(b, off, len);
+            }
+        }
+
+        @Override
+        public void flush() throws IOException {
+            fallback.flush();
+        }
+    }
+
+    private static final Map<String, Loaded> LOADED = new ConcurrentHashMap<>();
+    // Inheritable so threads started by hosted code still write to their request
+    private static final InheritableThreadLocal<ByteArrayOutputStream> OUT = new InheritableThreadLocal<>();
+    private static final InheritableThreadLocal<ByteArrayOutputStream> ERR = new InheritableThreadLocal<>();
+    private static byte[] token;
+
+    public static void main(String[] args) throws IOException {
+        PrintStream stdout = System.out;
+        PrintStream stderr = System.err;
+        // Stdout only carries the handshake; stray output goes to stderr
+        System.setOut(new PrintStream(new RoutingOutputStream(stderr, OUT), true, "UTF-8"));
+        System.setErr(new PrintStream(new RoutingOutputStream(stderr, ERR), true, "UTF-8"));
+
+        byte[] secret = new byte[32];
+        new SecureRandom().nextBytes(secret);
+        String encodedToken = Base64.getUrlEncoder().withoutPadding().encodeToString(secret);
+        token = encodedToken.getBytes(StandardCharsets.US_ASCII);
+
+        ServerSocket server = new ServerSocket(0, 50, InetAddress.getByName("127.0.0.1"));
+        stdout.println("PORT " + server.getLocalPort() + " " + encodedToken);
+        stdout.flush();
+
+        Thread watchdog = new Thread(() -> {
+            try {
+                while (System.in.read() != -1) {
+                    // Wait for the ExecutionEngine to close our stdin
+                }
+            } catch (IOException ignored) {
+                // Treat a broken pipe like a closed one
+            }
+            System.exit(0);
+        });
+        watchdog.setDaemon(true);
+        watchdog.start();
+
+        ExecutorService workers = Executors.newCachedThreadPool(runnable -> {
+            Thread thread = new Thread(runnable);
+            thread.setDaemon(true);
+            return thread;
+        });
+        while (true) {
+            Socket socket = server.accept();
+            workers.submit(() -> handle(socket));
+        }
+    }
+
+    private static void handle(Socket socket) {
+        try (Socket connection = socket;
+             BufferedReader in = new BufferedReader(new InputStreamReader(connection.getInputStream(), StandardCharsets.UTF_8));
+             Writer out = new OutputStreamWriter(connection.getOutputStream(), StandardCharsets.UTF_8)) {
+            String line = in.readLine();
+            if (line == null) {
+                return;
+            }
+            String[] fields = line.split("\t", -1);
+            if (fields.length < 3 || !MessageDigest.isEqual(token, fields[0].getBytes(StandardCharsets.US_ASCII))) {
+                System.err.println("Rejected a request without the host token");
+                return;
+            }
+            String target = decode(fields[2]);
+            String[] commandArgs = new String[fields.length - 3];
+            for (int i = 3; i < fields.length; i++) {
+                commandArgs[i - 3] = decode(fields[i]);
+            }
+
+            // The client closes the connection when it cancels or times out the request
+            Thread worker = Thread.currentThread();
+            AtomicBoolean done = new AtomicBoolean();
+            Thread monitor = new Thread(() -> {
+                try {
+                    while (in.read() != -1) {
+                        // Nothing else is sent after the request line
+                    }
+                } catch (IOException ignored) {
+                    // Treat a reset connection like a closed one
+                }
+                synchronized (done) {
+                    if (!done.get()) {
+                        worker.interrupt();
+                    }
+                }
+            });
+            monitor.setDaemon(true);
+            monitor.start();
+
+            ByteArrayOutputStream commandOut = new ByteArrayOutputStream();
+            ByteArrayOutputStream commandErr = new ByteArrayOutputStream();
+            OUT.set(commandOut);
+            ERR.set(commandErr);
+            int exitCode;
+            try {
+                exitCode = invoke(target, commandArgs);
+            } catch (InvocationTargetException e) {
+                e.getCause().printStackTrace();
+                exitCode = 1;
+            } catch (Exception e) {
+                e.printStackTrace();
+                exitCode = 1;
+            } finally {
+                synchronized (done) {
+                    done.set(true);
+                }
+                // Pool threads are reused, so do not leave an interrupt behind
+                Thread.interrupted();
+                System.out.flush();
+                System.err.flush();
+                OUT.remove();
+                ERR.remove();
+            }
+
+            out.write(fields[1] + "\t" + exitCode + "\t" + encode(commandOut) + "\t" + encode(commandErr) + "\n");
+            out.flush();
+        } catch (IOException e) {
+            e.printStackTrace();
+        }
+    }
+
+    private static int invoke(String target, String[] args) throws Exception {
+        Class<?> mainClass = load(target);
+        try {
+            Method hostMain = mainClass.getMethod("hostMain", String[].class);
+            if (Modifier.isStatic(hostMain.getModifiers()) && hostMain.getReturnType() == int.class) {
+                return (Integer) hostMain.invoke(null, (Object) args);
+            }
+        } catch (NoSuchMethodException ignored) {
+            // Plain main(String[]) below
+        }
+        mainClass.getMethod("main", String[].class).invoke(null, (Object) args);
+        return 0;
+    }
+
+    private static Class<?> load(String target) throws Exception {
+        boolean isJar = target.endsWith(".jar");
+        File file = new File(target);
+        long modified = isJar ? file.lastModified() : 0;
+        Loaded loaded = LOADED.get(target);
+        if (loaded != null && loaded.modified == modified) {
+            return loaded.mainClass;
+        }
+        // Loading is rare; serialize it so concurrent first requests share one loader
+        synchronized (LOADED) {
+            loaded = LOADED.get(target);
+            if (loaded != null && loaded.modified == modified) {
+                return loaded.mainClass;
+            }
+            Loaded replacement = define(target, file, isJar, modified);
+            LOADED.put(target, replacement);
+            if (loaded != null) {
+                // Releases the old jar, which Windows keeps locked while it is open
+                loaded.loader.close();
+            }
+            return replacement.mainClass;
+        }
+    }
+
+    private static Loaded define(String target, File file, boolean isJar, long modified) throws Exception {
+        String mainClassName;
+        URLClassLoader loader;
+        Class<?> mainClass;
+        if (isJar) {
+            try (JarFile jar = new JarFile(file)) {
+                Manifest manifest = jar.getManifest();
+                mainClassName = manifest == null ? null : manifest.getMainAttributes().getValue(Attributes.Name.MAIN_CLASS);
+            }
+            if (mainClassName == null) {
+                throw new IllegalArgumentException(target + " has no Main-Class in its manifest");
+            }
+            loader = new URLClassLoader(new URL[] {file.toURI().toURL()}, ClassLoader.getSystemClassLoader());
+        } else {
+            loader = new URLClassLoader(new URL[] {new File(".").toURI().toURL()}, ClassLoader.getSystemClassLoader());
+            mainClassName = target;
+        }
+        try {
+            mainClass = Class.forName(mainClassName, true, loader);
+        } catch (Exception | LinkageError e) {
+            loader.close();
+            throw e;
+        }
+        return new Loaded(modified, mainClass, loader);
+    }
+
+    private static String decode(String field) {
+        return new String(Base64.getDecoder().decode(field), StandardCharsets.UTF_8);
+    }
+
+    private static String encode(ByteArrayOutputStream buffer) {
+        return Base64.getEncoder().encodeToString(buffer.toByteArray());
+    }
+}
@@ -0,0 +1,75 @@
+#!/usr/bin/env node
+// Resident Node.js Host
+// Long-lived Node process used by the ExecutionEngine for in_process NODEJS commands.
+// Place this file at: workers/node_host.js
+//
+// Protocol: one JSON request per line on stdin, one JSON response per line on stdout.
+//   {"id": 1, "script_path": "scripts/x.js", "args": [...], "parsed_args": {...}}
+//     -> {"id": 1, "ok": true, "output": "..."}
+//     -> {"id": 1, "ok": false, "error": "..."}
+//
+// Each script is required once and must export a handler: either the module itself
+// is a function, or it exports run/handler. Handlers are called as
+// handler(parsedArgs, args) and may return a value or a Promise.
+
+'use strict';
+
+const path = require('path');
+const readline = require('readline');
+const util = require('util');
+
+// Keep stdout for the protocol; console output from handlers goes to stderr
+const writeResponse = (response) => process.stdout.write(JSON.stringify(response) + '\n');
+for (const method of ['log', 'info', 'debug']) {
+    console[method] = (...args) => process.stderr.write(util.format(...args) + '\n');
+}
+
+function loadHandler(scriptPath) {
+    // require() caches the module, so each script is only evaluated once
+    const mod = require(path.resolve(scriptPath));
+    if (typeof mod === 'function') {
+        return mod;
+    }
+    const handler = mod && (mod.run || mod.handler);
+    if (typeof handler !== 'function') {
+        throw new Error(`${scriptPath} does not export a handler function`);
+    }
+    return handler;
+}
+
+async function handle(request) {
+    try {
+        const handler = loadHandler(request.script_path);
+        const result = await handler(request.parsed_args || {}, request.args || []);
+        const output = result === undefined || result === null ? ''
+            : typeof result === 'string' ? result : JSON.stringify(result);
+        writeResponse({ id: request.id, ok: true, output });
+    } catch (err) {
+        writeResponse({ id: request.id, ok: false, error: err && err.stack ? err.stack : String(err) });
+    }
+}
+
+const input = readline.createInterface({ input: process.stdin });
+input.on('line', (line) => {
+    if (!line.trim()) {
+        return;
+    }
+    let request;
+    try {
+        request = JSON.parse(line);
+        if (request === null || typeof request !== 'object') {
+            throw new Error('expected a JSON object');
+        }
+    } catch (err) {
+        // The id is unknown, so nobody is waiting on this; keep serving the other requests
+        writeResponse({ id: null, ok: false, error: `Malformed request: ${err.message}` });
+        return;
+    }
+    if (request.ping) {
+        writeResponse({ id: request.id, pong: true });
+        return;
+    }
+    // Requests run concurrently; responses are matched by id
+    handle(request);
+});
+input.on('close', () => process.exit(0));
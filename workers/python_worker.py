@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Warm Python Worker
+Long-lived interpreter used by the ExecutionEngine worker pool.
+Place this file at: workers/python_worker.py
+
+Protocol: one JSON request per line on stdin, one JSON response per line on stdout.
+  {"id": 1, "script_path": "scripts/x.py", "args": [...]} -> {"id": 1, "returncode": 0, "stdout": "...", "stderr": "..."}
+  {"id": 2, "ping": true}                                  -> {"id": 2, "pong": true}
+
+Scripts run with stdin at end of file: input() raises EOFError and reads
+return nothing, since the real stdin carries the protocol. Each run gets
+fresh globals, but modules a script imports (including its own helper
+modules) are imported once per worker and keep their module-level state
+between runs. Scripts must not rely on that state, and must not assume it
+is reset either.
+"""
+
+import contextlib
+import io
+import json
+import os
+import sys
+import traceback
+
+# script_path -> (mtime, compiled code); imports made by scripts stay cached in sys.modules
+_code_cache = {}
+
+def load_script(script_path):
+    mtime = os.path.getmtime(script_path)
+    cached = _code_cache.get(script_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    with open(script_path, 'rb') as f:
+        code = compile(f.read(), script_path, 'exec')
+    _code_cache[script_path] = (mtime, code)
+    return code
+
+def run_script(script_path, args):
+    stdout, stderr = io.StringIO(), io.StringIO()
+    returncode = 0
+    saved_argv = sys.argv
+    # Mirror `python script.py`: argv and the script directory on sys.path
+    script_dir = os.path.dirname(os.path.abspath(script_path))
+    sys.argv = [script_path] + list(args)
+    sys.path.insert(0, script_dir)
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                code = load_script(script_path)
+                exec(code, {"__name__": "__main__", "__file__": script_path, "__builtins__": __builtins__})
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    returncode = e.code or 0
+                else:
+                    print(e.code, file=sys.stderr)
+                    returncode = 1
+            except BaseException:
+                traceback.print_exc()
+                returncode = 1
+    finally:
+        sys.argv = saved_argv
+        if script_dir in sys.path:
+            sys.path.remove(script_dir)
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+def main():
+    # Keep the protocol on private copies of stdin and stdout; stray writes to
+    # fd 1 go to stderr and reads from fd 0 (by scripts or their children) see EOF
+    requests = os.fdopen(os.dup(0), 'r')
+    protocol = os.fdopen(os.dup(1), 'w', buffering=1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    os.dup2(2, 1)
+
+    for line in requests:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        if request.get("ping"):
+            response = {"id": request.get("id"), "pong": True}
+        else:
+            returncode, stdout, stderr = run_script(request["script_path"], request.get("args", []))
+            response = {"id": request.get("id"), "returncode": returncode, "stdout": stdout, "stderr": stderr}
+        protocol.write(json.dumps(response) + "\n")
+
+if __name__ == "__main__":
+    main()